@@ -0,0 +1,336 @@
+# batchSim.py
+# -----------
+# Built from scratch. A vectorized copy of the GameState rules in
+# elevator.py that runs many independent episodes at once with numpy.
+#
+# Useful for evaluating policies that can pick actions for every episode
+# at once (e.g. random legal play), where running GameStates one at a time
+# would spend all its time in the Python interpreter.
+
+import time
+import numpy as np
+
+# actions are passed to step() as indices into this list
+ACTIONS = ['STALL', 'UP', 'DOWN', 'OPEN_UP', 'OPEN_DOWN']
+STALL, UP, DOWN, OPEN_UP, OPEN_DOWN = range(len(ACTIONS))
+
+
+class BatchSimulator:
+    """
+    Holds num_episodes independent elevator episodes as numpy arrays and
+    advances all of them with a single call to step(actions).
+
+    The rules are exactly those of GameState.generateSuccessor. Riders are
+    stored as aggregates wherever the rules allow it:
+    - riders in an elevator only matter through how many are headed to
+      each floor and the sum of their waits, so they're kept as
+      rider_count and rider_wait, indexed (episode, elevator, dest)
+    - waiting riders board in arrival order, so each floor keeps a real
+      queue of dests and arrival timesteps, indexed (episode, floor, slot),
+      which grows whenever a queue runs out of slots
+    """
+
+    def __init__(self, num_episodes, num_elevators=1, num_floors=10,
+                 capacity=20, traffic=0.25, queue_slots=16):
+        self.num_episodes = num_episodes
+        self.num_elevators = num_elevators
+        self.num_floors = num_floors
+        self.elevator_capacity = capacity
+        self.traffic = traffic
+        self.timestep = 0
+
+        N, E, F = num_episodes, num_elevators, num_floors
+        self.score = np.zeros(N, dtype=np.int64)
+        self.floors = np.zeros((N, E), dtype=np.int64)
+        self.rider_count = np.zeros((N, E, F), dtype=np.int64)
+        self.rider_wait = np.zeros((N, E, F), dtype=np.int64)
+        self.queue_dest = np.zeros((N, F, queue_slots), dtype=np.int64)
+        self.queue_arrival = np.zeros((N, F, queue_slots), dtype=np.int64)
+        self.queue_len = np.zeros((N, F), dtype=np.int64)
+        # number of waiting riders per floor wanting to go up/down
+        self.hall_up = np.zeros((N, F), dtype=np.int64)
+        self.hall_down = np.zeros((N, F), dtype=np.int64)
+        # running totals for the waiting penalty (see GameState)
+        self.num_waiting = np.zeros(N, dtype=np.int64)
+        self.arrival_sum = np.zeros(N, dtype=np.int64)
+
+    def getScores(self):
+        return self.score.astype(float)
+
+    def getLegalActionMask(self):
+        """
+        Returns a (episode, elevator, action) boolean array of which
+        actions are legal, following GameState.getLegalActionsForSingleElevator.
+        """
+        N, E, F = self.num_episodes, self.num_elevators, self.num_floors
+        floors = self.floors
+        episodes = np.arange(N)[:, None]
+        dests = np.arange(F)
+        below = (self.rider_count *
+                 (dests < floors[..., None])).sum(-1) > 0
+        above = (self.rider_count *
+                 (dests > floors[..., None])).sum(-1) > 0
+        # riders getting off here force the doors open
+        here = self.rider_count[episodes, np.arange(E)[None, :], floors] > 0
+        carrying = self.rider_count.sum(-1) > 0
+        # never change direction on a rider
+        can_go_up = (floors < F - 1) & ~below
+        can_go_down = (floors > 0) & ~above
+
+        mask = np.zeros((N, E, len(ACTIONS)), dtype=bool)
+        mask[..., STALL] = ~carrying
+        mask[..., UP] = can_go_up & ~here
+        mask[..., DOWN] = can_go_down & ~here
+        mask[..., OPEN_UP] = can_go_up & (here | (self.hall_up[episodes, floors] > 0))
+        mask[..., OPEN_DOWN] = can_go_down & (here | (self.hall_down[episodes, floors] > 0))
+        return mask
+
+    def sampleActions(self, mask=None):
+        """
+        Picks a uniformly random legal action for every elevator.
+        """
+        if mask is None:
+            mask = self.getLegalActionMask()
+        keys = np.random.random_sample(mask.shape)
+        keys[~mask] = -1.0
+        return keys.argmax(-1)
+
+    def sampleArrivals(self):
+        """
+        Samples one timestep of arrivals for every episode, with the same
+        distribution as GameState.generateArrivals. Returns (episode, src,
+        dest) arrays, grouped by episode in the order GameState uses.
+        """
+        N, F = self.num_episodes, self.num_floors
+        counts = np.random.poisson(self.traffic, size=(3, N))
+        everyone = np.arange(N)
+        # lots of riders are arriving at the ground
+        ep0 = np.repeat(everyone, counts[0])
+        src0 = np.zeros(len(ep0), dtype=np.int64)
+        dest0 = np.random.randint(1, F, size=len(ep0))
+        # lots of riders also want to get to the ground
+        ep1 = np.repeat(everyone, counts[1])
+        src1 = np.random.randint(1, F, size=len(ep1))
+        dest1 = np.zeros(len(ep1), dtype=np.int64)
+        # lots of random other movement throughout
+        # (a uniform pick among the other floors, instead of rejecting)
+        ep2 = np.repeat(everyone, counts[2])
+        src2 = np.random.randint(0, F, size=len(ep2))
+        dest2 = np.random.randint(0, F - 1, size=len(ep2))
+        dest2 += dest2 >= src2
+
+        episode = np.concatenate([ep0, ep1, ep2])
+        order = np.argsort(episode, kind='mergesort')
+        return (episode[order], np.concatenate([src0, src1, src2])[order],
+                np.concatenate([dest0, dest1, dest2])[order])
+
+    def step(self, actions, arrivals=None):
+        """
+        Advances every episode by one timestep. actions is an (episode,
+        elevator) array of indices into ACTIONS; arrivals defaults to a
+        fresh sampleArrivals().
+        """
+        actions = np.asarray(actions)
+        self.timestep += 1
+        timestep = self.timestep
+        # Elevator logic, one elevator at a time so that elevators opening
+        # on the same floor board riders in the same order as GameState.
+        for e in range(self.num_elevators):
+            action = actions[:, e]
+            self.floors[:, e] += action == UP
+            self.floors[:, e] -= action == DOWN
+            opening = np.nonzero((action == OPEN_UP) |
+                                 (action == OPEN_DOWN))[0]
+            if len(opening) > 0:
+                self._open(opening, e, action[opening] == OPEN_UP, timestep)
+        # Waiting penalty for everyone still waiting.
+        self.score -= self.num_waiting * timestep - self.arrival_sum
+        # Add new arrivals.
+        if arrivals is None:
+            arrivals = self.sampleArrivals()
+        self._addArrivals(arrivals, timestep)
+
+    def _open(self, episodes, e, going_up, timestep):
+        rows = np.arange(len(episodes))
+        floor = self.floors[episodes, e]
+        count = self.rider_count[episodes, e]
+        wait = self.rider_wait[episodes, e]
+        # Riders either get off or cause a waiting penalty.
+        self.score[episodes] -= count.sum(1) + wait.sum(1)
+        count[rows, floor] = 0
+        wait[rows, floor] = 0
+        wait += count
+
+        # Waiting riders on the floor can get on, in arrival order.
+        dest = self.queue_dest[episodes, floor]
+        arrival = self.queue_arrival[episodes, floor]
+        slots = np.arange(dest.shape[1])
+        valid = slots[None, :] < self.queue_len[episodes, floor][:, None]
+        heading_up = dest > floor[:, None]
+        eligible = valid & (heading_up == going_up[:, None])
+        room = self.elevator_capacity - count.sum(1)
+        board = eligible & (np.cumsum(eligible, 1) <= room[:, None])
+
+        # (np.bincount over flat indices is much faster than np.add.at)
+        board_rows, board_slots = np.nonzero(board)
+        cell = board_rows * self.num_floors + dest[board_rows, board_slots]
+        size = count.size
+        count += np.bincount(cell, minlength=size).reshape(count.shape)
+        # their wait so far is measured up to the previous timestep
+        waits = timestep - 1 - arrival[board_rows, board_slots]
+        wait += np.bincount(cell, waits, minlength=size).reshape(
+            wait.shape).astype(np.int64)
+        self.rider_count[episodes, e] = count
+        self.rider_wait[episodes, e] = wait
+
+        boarded = board.sum(1)
+        self.num_waiting[episodes] -= boarded
+        self.arrival_sum[episodes] -= (arrival * board).sum(1)
+        self.hall_up[episodes, floor] -= (board & heading_up).sum(1)
+        self.hall_down[episodes, floor] -= (board & ~heading_up).sum(1)
+        # close the gaps left in the queues, keeping arrival order
+        order = np.argsort(board, axis=1, kind='mergesort')
+        self.queue_dest[episodes, floor] = dest[rows[:, None], order]
+        self.queue_arrival[episodes, floor] = arrival[rows[:, None], order]
+        self.queue_len[episodes, floor] -= boarded
+
+    def _addArrivals(self, arrivals, timestep):
+        episode, src, dest = [np.asarray(a, dtype=np.int64) for a in arrivals]
+        if len(episode) == 0:
+            return
+        # position of each arrival within its (episode, floor) queue
+        key = episode * self.num_floors + src
+        order = np.argsort(key, kind='mergesort')
+        episode, src, dest, key = episode[order], src[order], dest[order], key[order]
+        index = np.arange(len(key))
+        first = np.concatenate([[True], key[1:] != key[:-1]])
+        rank = index - np.maximum.accumulate(np.where(first, index, 0))
+        slot = self.queue_len[episode, src] + rank
+        if slot.max() >= self.queue_dest.shape[2]:
+            self._growQueues(slot.max() + 1)
+
+        self.queue_dest[episode, src, slot] = dest
+        self.queue_arrival[episode, src, slot] = timestep
+        size = self.queue_len.size
+        shape = self.queue_len.shape
+        self.queue_len += np.bincount(key, minlength=size).reshape(shape)
+        self.hall_up += np.bincount(key, dest > src,
+                                    minlength=size).reshape(shape).astype(np.int64)
+        self.hall_down += np.bincount(key, dest < src,
+                                      minlength=size).reshape(shape).astype(np.int64)
+        arrived = np.bincount(episode, minlength=self.num_episodes)
+        self.num_waiting += arrived
+        self.arrival_sum += arrived * timestep
+
+    def _growQueues(self, needed):
+        slots = max(needed, 2 * self.queue_dest.shape[2])
+        extra = slots - self.queue_dest.shape[2]
+        padding = ((0, 0), (0, 0), (0, extra))
+        self.queue_dest = np.pad(self.queue_dest, padding, 'constant')
+        self.queue_arrival = np.pad(self.queue_arrival, padding, 'constant')
+
+
+def runBatch(num_episodes, num_steps=100, num_elevators=1, num_floors=10,
+             capacity=20, traffic=0.25, policy=None):
+    """
+    Plays num_episodes episodes of num_steps steps each and returns the
+    final scores. policy takes the simulator and returns an (episode,
+    elevator) array of actions; it defaults to uniformly random legal play.
+    """
+    sim = BatchSimulator(num_episodes, num_elevators=num_elevators,
+                         num_floors=num_floors, capacity=capacity,
+                         traffic=traffic)
+    if policy is None:
+        policy = lambda sim: sim.sampleActions()
+    for _ in range(num_steps):
+        sim.step(policy(sim))
+    return sim.getScores()
+
+
+def checkAgainstGameState(num_episodes=50, num_steps=200, num_elevators=4,
+                          num_floors=10, capacity=5, traffic=0.5):
+    """
+    Differential test: plays the same random legal actions and the same
+    arrivals through a BatchSimulator and through one GameState per
+    episode, and raises an Exception at the first step where legal
+    actions, scores, positions or rider counts disagree.
+    """
+    from elevator import GameState
+
+    class ScriptedState(GameState):
+        """
+        GameState that takes its arrivals from next_arrivals
+        instead of sampling them.
+        """
+        __slots__ = ()
+        next_arrivals = []
+
+        def generateArrivals(self, timestep):
+            return ScriptedState.next_arrivals
+
+    sim = BatchSimulator(num_episodes, num_elevators=num_elevators,
+                         num_floors=num_floors, capacity=capacity,
+                         traffic=traffic)
+    states = [ScriptedState(num_elevators=num_elevators,
+                            num_floors=num_floors, capacity=capacity,
+                            traffic=traffic)
+              for _ in range(num_episodes)]
+    for t in range(num_steps):
+        mask = sim.getLegalActionMask()
+        actions = sim.sampleActions(mask)
+        arrivals = sim.sampleArrivals()
+        for n in range(num_episodes):
+            for e in range(num_elevators):
+                legal = set(states[n].getLegalActionsForSingleElevator(e))
+                batch_legal = set([ACTIONS[a] for a in range(len(ACTIONS))
+                                   if mask[n, e, a]])
+                if legal != batch_legal:
+                    raise Exception('Step %d, episode %d, elevator %d: legal '
+                                    'actions %s != %s' %
+                                    (t, n, e, sorted(batch_legal), sorted(legal)))
+            ScriptedState.next_arrivals = [
+                (src, dest) for ep, src, dest in zip(*arrivals) if ep == n]
+            action = tuple([ACTIONS[a] for a in actions[n]])
+            states[n] = states[n].generateSuccessor(action)
+        sim.step(actions, arrivals)
+
+        for n in range(num_episodes):
+            state = states[n]
+            expected = (state.score, list(state.elevator_floors),
+                        [len(riders) for riders in state.elevator_riders],
+                        [len(queue) for queue in state.waiting_queues])
+            actual = (sim.score[n], list(sim.floors[n]),
+                      list(sim.rider_count[n].sum(-1)), list(sim.queue_len[n]))
+            if expected != actual:
+                raise Exception('Step %d, episode %d: batch %s != GameState %s'
+                                % (t + 1, n, actual, expected))
+    return True
+
+
+if __name__ == '__main__':
+    """
+    Checks the batch simulator against GameState, then compares
+    the throughput of both on random legal play.
+
+    > python batchSim.py
+    """
+    import random
+    from elevator import GameState
+
+    checkAgainstGameState()
+    print 'Batch simulator agrees with GameState'
+
+    num_episodes, num_steps = 2000, 100
+    start = time.time()
+    runBatch(num_episodes, num_steps, num_elevators=4)
+    batch_rate = num_episodes * num_steps / (time.time() - start)
+
+    num_scalar = 50
+    start = time.time()
+    for _ in range(num_scalar):
+        state = GameState(num_elevators=4)
+        for _ in range(num_steps):
+            state = state.generateSuccessor(state.getLegalActions().sample())
+    scalar_rate = num_scalar * num_steps / (time.time() - start)
+    print 'Episode steps/sec: batch %.0f, GameState %.0f (%.1fx)' % (
+        batch_rate, scalar_rate, batch_rate / scalar_rate)
@@ -0,0 +1,336 @@
+# benchmark.py
+# ------------
+# Built from scratch for the simulator in elevator.py and the agents that
+# play it.
+#
+# Times the hot paths of the simulation and the agents, plus whole
+# episodes, over a grid of buildings and traffic. Rates can be saved as a
+# JSON baseline and later runs compared against it, so optimizations can
+# be checked against numbers instead of impressions.
+
+import sys, time, json, platform
+from elevator import (GameState, ArrivalStream, MonteCarloPlanner,
+                      runGame, runMonteCarlo, seedEpisode)
+from naiveAgent import NaiveAgent
+from qlearningAgents import QLearningAgent
+
+# Every benchmark plays its part on the same recorded trajectory (see
+# getTrajectory) and returns (things done, seconds spent doing them), so
+# setup isn't timed. Each run gets its own copies of the trajectory's
+# states (see getFreshStates), so nothing a run caches on them is there
+# for the next.
+
+def getTrajectory(config, num_steps, episode_seed=0):
+    """
+    The states and actions of an episode of the naive agent, which keeps
+    the building in the kind of states real games see.
+    """
+    seedEpisode(episode_seed)
+    state = GameState(num_elevators=config['numElevators'],
+                      num_floors=config['numFloors'],
+                      capacity=config['capacity'], traffic=config['traffic'],
+                      arrivals=ArrivalStream(config['numFloors'],
+                                             config['traffic'],
+                                             chunk_size=num_steps + 2))
+    agent = NaiveAgent()
+    states, actions = [], []
+    for _ in range(num_steps):
+        action = agent.getAction(state)
+        states.append(state)
+        actions.append(action)
+        state = state.generateSuccessor(action)
+    states.append(state)
+    return states, actions
+
+def getFreshStates(states):
+    """
+    Copies of states with none of the views and keys they've cached, as
+    states new to the game would be.
+    """
+    return [state.deepCopy() for state in states]
+
+def benchGenerateSuccessor(config, states, actions):
+    start = time.time()
+    for state, action in zip(states, actions):
+        state.generateSuccessor(action)
+    return len(actions), time.time() - start
+
+def benchGetLegalActions(config, states, actions):
+    start = time.time()
+    for state in states:
+        state.getLegalActions()
+    return len(states), time.time() - start
+
+def benchGenerateArrivals(config, states, actions):
+    # a fresh stream, so sampling its chunks is timed too
+    start = time.time()
+    arrivals = ArrivalStream(config['numFloors'], config['traffic'])
+    for t in range(len(actions)):
+        arrivals.getArrivals(t)
+    return len(actions), time.time() - start
+
+def benchNaiveAction(config, states, actions):
+    agent = NaiveAgent()
+    start = time.time()
+    for state in states:
+        agent.getAction(state)
+    return len(states), time.time() - start
+
+# agents stay in training for every episode they're timed on
+TRAINING_EPISODES = 10 ** 6
+
+def getTrainedAgent(states, actions):
+    """
+    A QLearningAgent that has learned from the trajectory once, so it
+    acts from a table with something in it. It learns from copies of
+    states, so the keys it works out aren't cached on the ones timed.
+    """
+    agent = QLearningAgent(numTraining=TRAINING_EPISODES)
+    agent.startEpisode()
+    states = getFreshStates(states)
+    for i in range(len(actions)):
+        agent.update(states[i], actions[i], states[i + 1],
+                     states[i + 1].getScore() - states[i].getScore())
+    return agent
+
+def benchQLearningAction(config, states, actions):
+    agent = getTrainedAgent(states, actions)
+    start = time.time()
+    for state in states:
+        agent.getAction(state)
+    return len(states), time.time() - start
+
+def benchQLearningUpdate(config, states, actions):
+    agent = QLearningAgent(numTraining=TRAINING_EPISODES)
+    agent.startEpisode()
+    rewards = [states[i + 1].getScore() - states[i].getScore()
+               for i in range(len(actions))]
+    start = time.time()
+    for i in range(len(actions)):
+        agent.update(states[i], actions[i], states[i + 1], rewards[i])
+    return len(actions), time.time() - start
+
+# Monte Carlo decisions are slow, so only every MONTE_CARLO_STRIDE-th
+# state of the trajectory gets one.
+MONTE_CARLO_STRIDE = 10
+MONTE_CARLO_ROLLOUTS = 20
+
+def benchMonteCarloAction(config, states, actions):
+    planner = MonteCarloPlanner(num_rollouts=MONTE_CARLO_ROLLOUTS)
+    decisions = states[::MONTE_CARLO_STRIDE]
+    start = time.time()
+    for state in decisions:
+        planner.getAction(state)
+    return len(decisions), time.time() - start
+
+def benchNaiveEpisode(config, states, actions):
+    start = time.time()
+    game = runGame(NaiveAgent(), len(actions), True, config['numElevators'],
+                   config['numFloors'], config['capacity'], config['traffic'])
+    return game.num_moves, time.time() - start
+
+def benchQLearningEpisode(config, states, actions):
+    # a training episode: acting and learning every step
+    start = time.time()
+    agent = QLearningAgent(numTraining=TRAINING_EPISODES)
+    game = runGame(agent, len(actions), True, config['numElevators'],
+                   config['numFloors'], config['capacity'], config['traffic'])
+    return game.num_moves, time.time() - start
+
+def benchMonteCarloEpisode(config, states, actions):
+    num_steps = len(actions) / MONTE_CARLO_STRIDE
+    start = time.time()
+    runMonteCarlo(num_timesteps=num_steps,
+                  num_elevators=config['numElevators'],
+                  num_floors=config['numFloors'], capacity=config['capacity'],
+                  traffic=config['traffic'],
+                  planner=MonteCarloPlanner(num_rollouts=MONTE_CARLO_ROLLOUTS))
+    return num_steps, time.time() - start
+
+# (name, micro or macro, unit, function)
+BENCHMARKS = [
+    ('generateSuccessor', 'micro', 'steps/sec', benchGenerateSuccessor),
+    ('getLegalActions', 'micro', 'calls/sec', benchGetLegalActions),
+    ('generateArrivals', 'micro', 'steps/sec', benchGenerateArrivals),
+    ('NaiveAgent.getAction', 'micro', 'decisions/sec', benchNaiveAction),
+    ('QLearningAgent.getAction', 'micro', 'decisions/sec',
+     benchQLearningAction),
+    ('QLearningAgent.update', 'micro', 'updates/sec', benchQLearningUpdate),
+    ('MonteCarloPlanner.getAction', 'micro', 'decisions/sec',
+     benchMonteCarloAction),
+    ('naive episode', 'macro', 'steps/sec', benchNaiveEpisode),
+    ('rl training episode', 'macro', 'steps/sec', benchQLearningEpisode),
+    ('monte episode', 'macro', 'steps/sec', benchMonteCarloEpisode),
+]
+
+def getConfigs(floors, elevators, capacities, traffics):
+    """
+    Every combination of the given parameters.
+    """
+    return [{'numFloors': f, 'numElevators': e, 'capacity': c, 'traffic': t}
+            for f in floors for e in elevators for c in capacities
+            for t in traffics]
+
+def getResultKey(name, config):
+    return '%s/floors=%d,elevators=%d,capacity=%d,traffic=%g' % (
+        name, config['numFloors'], config['numElevators'],
+        config['capacity'], config['traffic'])
+
+def runBenchmarks(configs, num_steps=500, repeats=3, min_time=0.2,
+                  names=None, quiet=False):
+    """
+    Runs every benchmark (or those in names) on every config, repeats
+    times each, and returns a dict of results by getResultKey.
+
+    A single run can take a few milliseconds, which is too short to time
+    reliably, so each repeat runs the benchmark again until it has taken
+    min_time seconds. A result's rate is the best of its repeats, the
+    least disturbed by whatever else the machine was doing. Every run
+    is given fresh copies of the trajectory's states, so it pays for
+    the keys and views it needs like a real game does.
+    """
+    results = {}
+    for config in configs:
+        states, actions = getTrajectory(config, num_steps)
+        for name, kind, unit, function in BENCHMARKS:
+            if names is not None and name not in names:
+                continue
+            rate = 0.0
+            for repeat in range(repeats):
+                seedEpisode(repeat)
+                total_count, total_seconds = 0, 0.0
+                while total_seconds < min_time:
+                    count, seconds = function(config,
+                                              getFreshStates(states), actions)
+                    total_count += count
+                    total_seconds += seconds
+                rate = max(rate, total_count / total_seconds)
+            key = getResultKey(name, config)
+            results[key] = dict(config, benchmark=name, kind=kind,
+                                unit=unit, rate=rate)
+            if not quiet:
+                print '%-70s %12.1f %s' % (key, rate, unit)
+    return results
+
+def saveBaseline(path, results, num_steps, repeats, min_time):
+    baseline = {'python': platform.python_version(),
+                'platform': platform.platform(),
+                'steps': num_steps, 'repeats': repeats, 'minTime': min_time,
+                'results': results}
+    f = open(path, 'w')
+    json.dump(baseline, f, indent=1, sort_keys=True)
+    f.close()
+
+def loadBaseline(path):
+    f = open(path)
+    baseline = json.load(f)
+    f.close()
+    return baseline
+
+def compareResults(baseline, results, threshold=0.1):
+    """
+    Prints every result next to its baseline, and returns the keys of
+    those that got slower by more than the fraction threshold.
+    Results missing from either side are skipped.
+    """
+    regressions = []
+    print '%-70s %12s %12s %8s' % ('benchmark', 'baseline', 'now', 'change')
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        old, new = baseline[key]['rate'], results[key]['rate']
+        change = new / old - 1.0
+        flag = ''
+        if change < -threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        print '%-70s %12.1f %12.1f %+7.1f%%%s' % (key, old, new,
+                                                  100 * change, flag)
+    return regressions
+
+def readCommand(argv):
+    """
+    Processes the command used to run the benchmarks.
+    """
+    from optparse import OptionParser
+    usageStr = """
+    USAGE:      python benchmark.py <options>
+    EXAMPLES:   (1) python benchmark.py --save baseline.json
+                    - times everything and saves the rates as a baseline
+                (2) python benchmark.py --compare baseline.json
+                    - times everything again and flags regressions
+                (3) python benchmark.py --benchmarks generateSuccessor -e 4
+                    - times one benchmark on four elevator buildings
+    """
+    parser = OptionParser(usageStr)
+    parser.add_option('--save', dest='save', metavar='PATH',
+                      help='Save the results as a JSON baseline', default=None)
+    parser.add_option('--compare', dest='compare', metavar='PATH',
+                      help='Compare the results with a saved baseline, and '
+                           'exit with status 1 if any regressed',
+                      default=None)
+    parser.add_option('--threshold', dest='threshold', type='float',
+                      help='Slowdown counted as a regression, as a fraction '
+                           '(default %default)', default=0.1)
+    parser.add_option('--benchmarks', dest='benchmarks',
+                      help='Comma-separated benchmarks to run (default all: ' +
+                           ', '.join([b[0] for b in BENCHMARKS]) + ')',
+                      default=None)
+    parser.add_option('-s', '--numSteps', dest='numSteps', type='int',
+                      help='Steps per trajectory (default %default)',
+                      default=500)
+    parser.add_option('-r', '--repeats', dest='repeats', type='int',
+                      help='Times to run each benchmark, keeping the best '
+                           '(default %default)', default=3)
+    parser.add_option('--minTime', dest='minTime', type='float',
+                      help='Seconds each repeat runs its benchmark for, at '
+                           'least (default %default)', default=0.2)
+    parser.add_option('-x', '--numFloors', dest='numFloors',
+                      help='Comma-separated floor counts (default %default)',
+                      default='10,20')
+    parser.add_option('-e', '--numElevators', dest='numElevators',
+                      help='Comma-separated elevator counts (default %default)',
+                      default='1,4')
+    parser.add_option('-c', '--capacity', dest='capacity',
+                      help='Comma-separated capacities (default %default)',
+                      default='20')
+    parser.add_option('-z', '--traffic', dest='traffic',
+                      help='Comma-separated Poisson lambdas (default %default)',
+                      default='0.25,1.0')
+
+    options, otherjunk = parser.parse_args(argv)
+    if len(otherjunk) != 0:
+        raise Exception('Command line input not understood: ' + str(otherjunk))
+    names = None
+    if options.benchmarks is not None:
+        names = options.benchmarks.split(',')
+        known = [b[0] for b in BENCHMARKS]
+        for name in names:
+            if name not in known:
+                raise Exception('Unknown benchmark: ' + name)
+    configs = getConfigs([int(x) for x in options.numFloors.split(',')],
+                         [int(x) for x in options.numElevators.split(',')],
+                         [int(x) for x in options.capacity.split(',')],
+                         [float(x) for x in options.traffic.split(',')])
+    return options, configs, names
+
+if __name__ == '__main__':
+    """
+    Runs the benchmarks from the command line; see readCommand.
+
+    > python benchmark.py --help
+    """
+    options, configs, names = readCommand(sys.argv[1:])
+    results = runBenchmarks(configs, options.numSteps, options.repeats,
+                            options.minTime, names,
+                            quiet=options.compare is not None)
+    if options.save is not None:
+        saveBaseline(options.save, results, options.numSteps, options.repeats,
+                     options.minTime)
+    if options.compare is not None:
+        regressions = compareResults(loadBaseline(options.compare)['results'],
+                                     results, options.threshold)
+        if regressions:
+            print '%d of %d benchmarks regressed by more than %.0f%%' % (
+                len(regressions), len(results), 100 * options.threshold)
+            sys.exit(1)
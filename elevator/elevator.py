@@ -35,32 +35,287 @@ code to run a game. This file is divided into three sections:
           Check this section out to see all the options available to you.
 """
 
-from game import Game
+from game import Game, JointActions
 import util
-import sys, types, time, random, os, copy
+import sys, types, time, random, os, copy, math
+import multiprocessing, cPickle
 from qlearningAgents import *
 from naiveAgent import *
-from numpy.random import seed, poisson
+from mctsAgent import *
+from qTable import QTable
+from stateKey import StateKey
+from resultsWriter import ResultsWriter
+from phaseProfiler import PhaseProfiler
+from numpy.random import seed, poisson, randint
+import numpy
 
 ###################################################
 # YOUR INTERFACE TO THE PACMAN WORLD: A GameState #
 ###################################################
 
-class GameState:
+class ArrivalStream:
+    """
+    Rider arrivals, sampled ahead of time in chunks of chunk_size timesteps
+    with a handful of vectorized numpy calls, then handed out one timestep
+    at a time by getArrivals.
+
+    Pass the episode length as chunk_size to sample a whole episode at
+    once. A stream holds a single chunk and never changes once it's
+    sampled, so any number of states can share it: a state that runs
+    past the end moves on to a stream of its own for the next chunk (see
+    getNextStream and GameState.generateArrivals), which nobody else
+    sees, and long horizons don't use more memory.
+
+    A private stream is a real game's: copies of the game's states don't
+    get it (see GameState), so agents can't see the arrivals to come.
+    """
+    def __init__(self, num_floors, traffic, chunk_size=1024, start=0,
+                 private=False):
+        self.num_floors = num_floors
+        self.traffic = traffic
+        self.chunk_size = chunk_size
+        self.private = private
+        self.sampleChunk(start)
+
+    def sampleChunk(self, start):
+        """
+        Samples the arrivals for timesteps start to start + chunk_size - 1.
+        """
+        n = self.chunk_size
+        F = self.num_floors
+        # TODO: possible extension--non-constant lambdas
+        # columns: arriving at the ground, going to the ground, random
+        counts = poisson(self.traffic, size=(n, 3))
+        timesteps = numpy.arange(n)
+        num_ground_source, num_ground_dest, num_random = counts.sum(0)
+        # lots of riders are arriving at the ground: lambda = #/timestep
+        src0 = numpy.zeros(num_ground_source, dtype=int)
+        dest0 = randint(1, F, size=num_ground_source)
+        # lots of riders also want to get to the ground: lambda = #/timestep
+        src1 = randint(1, F, size=num_ground_dest)
+        dest1 = numpy.zeros(num_ground_dest, dtype=int)
+        # lots of random other movement throughout
+        # (a uniform pick among the other floors, instead of rejecting)
+        src2 = randint(0, F, size=num_random)
+        dest2 = randint(0, F - 1, size=num_random)
+        dest2 += dest2 >= src2
+        # combine all three, grouped by timestep!
+        arrival_times = numpy.concatenate([numpy.repeat(timesteps, counts[:, k])
+                                           for k in range(3)])
+        order = numpy.argsort(arrival_times, kind='mergesort')
+        self.sources = numpy.concatenate([src0, src1, src2])[order].tolist()
+        self.dests = numpy.concatenate([dest0, dest1, dest2])[order].tolist()
+        self.offsets = [0] + numpy.cumsum(counts.sum(1)).tolist()
+        self.start = start
+
+    def hasTimestep(self, timestep):
+        return 0 <= timestep - self.start < self.chunk_size
+
+    def getNextStream(self, timestep):
+        """
+        Returns a new stream like this one whose chunk starts at timestep.
+        """
+        return ArrivalStream(self.num_floors, self.traffic, self.chunk_size,
+                             timestep, self.private)
+
+    def getArrivals(self, timestep):
+        """
+        Returns the list of (source, dest) riders arriving at timestep,
+        which has to be in the chunk (see hasTimestep).
+        """
+        i = timestep - self.start
+        if not 0 <= i < self.chunk_size:
+            raise Exception('Arrivals for timestep %d are not in this chunk'
+                            % timestep)
+        a, b = self.offsets[i], self.offsets[i + 1]
+        return zip(self.sources[a:b], self.dests[a:b])
+
+
+class ReadOnlyDict(dict):
+    """
+    A dict that can't be changed after it's made, for read-only views.
+    """
+    def readOnly(self, *args, **kwargs):
+        raise TypeError('ReadOnlyDict can not be changed')
+    __setitem__ = __delitem__ = clear = pop = popitem = readOnly
+    setdefault = update = readOnly
+
+    def __reduce__(self):
+        return (ReadOnlyDict, (dict(self),))
+
+
+class TimeHistogram:
+    """
+    Counts of whole numbers of timesteps, one bin per value below
+    max_time plus one for everything from max_time up, so it takes the
+    same memory however many times are added. Quantiles are exact as
+    long as no time reaches max_time; ones that land in the last bin are
+    reported as the largest time seen.
+
+    add is called for every rider, so it only bumps a count; totals are
+    worked out from the counts when asked for.
+    """
+    def __init__(self, max_time=1024):
+        self.max_time = max_time
+        self.counts = [0] * max_time
+        # times from max_time up: how many, their sum and the largest
+        self.overflow = [0, 0, None]
+
+    def add(self, time):
+        if time < self.max_time:
+            self.counts[time] += 1
+        else:
+            overflow = self.overflow
+            overflow[0] += 1
+            overflow[1] += time
+            overflow[2] = max(time, overflow[2])
+
+    def merge(self, other):
+        """
+        Adds in the counts of another histogram with the same max_time.
+        """
+        if other.max_time != self.max_time:
+            raise Exception('Histograms with different max_time: %d, %d'
+                            % (self.max_time, other.max_time))
+        for t, count in enumerate(other.counts):
+            self.counts[t] += count
+        count, total, largest = other.overflow
+        self.overflow[0] += count
+        self.overflow[1] += total
+        self.overflow[2] = max(largest, self.overflow[2])
+
+    def getCount(self):
+        return sum(self.counts) + self.overflow[0]
+    count = property(getCount)
+
+    def getMean(self):
+        count = self.getCount()
+        if count == 0:
+            return None
+        total = sum([t * n for t, n in enumerate(self.counts)])
+        return (total + self.overflow[1]) / float(count)
+
+    def getQuantile(self, q):
+        """
+        The smallest time that at least a fraction q of the times are at
+        most (None if there are none).
+        """
+        count = self.getCount()
+        if count == 0:
+            return None
+        rank = max(int(math.ceil(q * count)), 1)
+        seen = 0
+        for t in range(self.max_time):
+            seen += self.counts[t]
+            if seen >= rank:
+                return t
+        return self.overflow[2]
+
+
+class RiderStats:
+    """
+    How long riders took over an episode: waits, counted when a rider
+    gets on, and trip times (from arrival to getting off), counted when
+    they get off. Shared along a game's trajectory like its arrivals;
+    other copies of its states have none (see GameState).
+    """
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, max_time=1024):
+        self.waits = TimeHistogram(max_time)
+        self.trips = TimeHistogram(max_time)
+
+    def merge(self, other):
+        self.waits.merge(other.waits)
+        self.trips.merge(other.trips)
+
+    def getSummary(self):
+        """
+        A flat dict of the mean and QUANTILES of both times, with keys
+        like wait_p95 and trip_mean, for results records.
+        """
+        summary = {}
+        for name, histogram in (('wait', self.waits), ('trip', self.trips)):
+            summary[name + '_mean'] = histogram.getMean()
+            for q in self.QUANTILES:
+                summary['%s_p%d' % (name, round(q * 100))] = \
+                    histogram.getQuantile(q)
+        return summary
+
+    def __str__(self):
+        lines = []
+        for name, histogram in (('Wait', self.waits), ('Trip', self.trips)):
+            if histogram.count == 0:
+                lines.append('%s times: none' % name)
+                continue
+            lines.append('%s times: mean %.1f, %s (%d riders)' % (
+                name, histogram.getMean(),
+                ', '.join(['p%d %d' % (round(q * 100), histogram.getQuantile(q))
+                           for q in self.QUANTILES]),
+                histogram.count))
+        return '\n'.join(lines)
+
+
+class GameState(object):
     """
     A GameState specifies the full game state, including the elevators,
     riders, and score changes.
 
     GameStates are used by the Game object to capture the actual state of the game and
-    can be used by agents to reason about the game.
+    can be used by agents to reason about the game. The game moves on with
+    generateNextState; successors and copies made any other way don't
+    share the game's private arrival stream or its rider stats, and sample
+    arrivals of their own instead, so reasoning ahead never sees (or
+    disturbs) what is really going to happen.
 
     Unlike the original Pacman project, the GameState is not a wrapper around
     a GameStateData object: it contains most of its information directly.
 
     Note that, unlike Pacman, the system of all elevators are considered
     a single agent acting at once.
+
+    The state is stored in flat, slotted fields so successors are cheap:
+    - elevator_floors: list of the floor each elevator is on
+    - elevator_riders: list (per elevator) of tuples of
+      (dest, wait, arrival) riders
+    - waiting_queues: list (per floor) of tuples of (dest, arrival) riders
+    The rider tuples are immutable, so a successor shares every one of them
+    with its predecessor and only replaces the ones that actually change
+    (copy-on-write). Never mutate them in place. Successors are read-only
+    too: their containers are tuples, so the game can hand its states to
+    agents as they are (see getReadOnlyView). deepCopy gives a state with
+    lists, for simulations to step in place with applyAction.
+
+    Waiting riders only store the timestep they arrived at, so their wait
+    is just timestep - arrival. The per-tick waiting penalty is computed
+    from the running totals num_waiting and arrival_sum, instead of
+    touching every waiting rider each tick.
+
+    rider_stats, if not None, is a RiderStats that records how long each
+    rider waited and rode as they get on and off. Only states along the
+    game's trajectory have one.
     """
 
+    __slots__ = ('num_elevators', 'num_floors', 'elevator_capacity',
+                 'arrivals', 'traffic', 'timestep', 'score',
+                 'elevator_floors', 'elevator_riders', 'waiting_queues',
+                 'num_waiting', 'arrival_sum', 'elevator_dests', 'hall_calls',
+                 'rider_stats', '_elevators', '_waiting_riders', '_keys',
+                 '_journal', '_readonly')
+
+    # What getStateKey can leave out of a state:
+    # - exact: nothing, including the timestep and score
+    # - relative: no timestep or score, and waits measured from now
+    # - destinations: only elevator floors and where every rider is going
+    # - calls: only what each elevator sees from where it is: whether it's
+    #   at the bottom or top, which way its riders are going (if anywhere),
+    #   whether any get off here, the hall calls on its floor and whether
+    #   there are calls above or below. That's all its legal actions
+    #   depend on (see getActionSignature), so keys still tell them apart.
+    #   The others keep nearly every state apart (around 1% of keys come
+    #   up again over random episodes), so this is the one tables learn on
+    STATE_ABSTRACTIONS = ('exact', 'relative', 'destinations', 'calls')
+
     ####################################################
     # Accessor methods: use these to access state data #
     ####################################################
@@ -73,6 +328,36 @@ class GameState:
         return tmp
     getAndResetExplored = staticmethod(getAndResetExplored)
 
+    def getElevators(self):
+        """
+        Read-only view of the elevators as the old list of
+        {'floor': f, 'riders': [(dest, wait), ...]} dicts, made of tuples
+        and ReadOnlyDicts so nobody can change it for everyone else.
+        Built lazily and cached, since the state never changes after it's
+        generated.
+        """
+        if self._elevators is None:
+            self._elevators = tuple([
+                ReadOnlyDict(floor=self.elevator_floors[i],
+                             riders=tuple([(dest, wait) for dest, wait, _
+                                           in self.elevator_riders[i]]))
+                for i in range(self.num_elevators)])
+        return self._elevators
+    elevators = property(getElevators)
+
+    def getWaitingRiders(self):
+        """
+        Read-only view of the waiting riders as the old list (per floor)
+        of [(dest, wait), ...] lists, as tuples. Built lazily and cached.
+        """
+        if self._waiting_riders is None:
+            timestep = self.timestep
+            self._waiting_riders = tuple([tuple([(dest, timestep - arrival)
+                                                 for dest, arrival in queue])
+                                          for queue in self.waiting_queues])
+        return self._waiting_riders
+    waiting_riders = property(getWaitingRiders)
+
     # get the actions possible for a single elevator based
     # on its floor and the riders it's carrying
     # there are four legel actions:
@@ -80,34 +365,54 @@ class GameState:
     # - OPEN_UP, OPEN_DOWN (open while indicating the elevator intends to
     # go in that direction next; it's not a guarantee though!)
     # - STALL (just wait!)
+    # The answer only depends on a small signature of the elevator (see
+    # getActionSignature), so it's looked up in a cache shared by all states.
     def getLegalActionsForSingleElevator(self, elevator_id):
-        elevator = self.elevators[elevator_id]
-        # Default to physical limitations.
-        can_stall = True
-        can_go_down = elevator['floor'] > 0
-        can_go_up = elevator['floor'] < self.num_floors - 1
-        must_open = False
+        """
+        Returns the tuple of legal actions for one elevator.
+        """
+        signature = self.getActionSignature(elevator_id)
+        actions = GameState.legal_actions_cache.get(signature)
+        if actions is None:
+            if len(GameState.legal_actions_cache) >= GameState.LEGAL_ACTIONS_CACHE_SIZE:
+                GameState.legal_actions_cache.clear()
+            actions = GameState.getLegalActionsForSignature(signature)
+            GameState.legal_actions_cache[signature] = actions
+        return actions
+
+    # cache of signature => legal actions for a single elevator
+    legal_actions_cache = {}
+    LEGAL_ACTIONS_CACHE_SIZE = 1024
+
+    def getActionSignature(self, elevator_id):
+        """
+        Everything the legal actions of an elevator depend on:
+        (at bottom floor, at top floor, carrying riders, riders going down,
+        riders going up, riders getting off here, hall call down, hall call up)
+        Built from elevator_dests and hall_calls, which generateSuccessor
+        keeps up to date, so it never looks at individual riders.
+        """
+        floor = self.elevator_floors[elevator_id]
+        num_up, num_down = self.hall_calls[floor]
+        dests = self.elevator_dests[elevator_id]
+        if dests is None:
+            return (floor == 0, floor == self.num_floors - 1,
+                    False, False, False, False, num_down > 0, num_up > 0)
+        lowest, highest, dest_set = dests
+        return (floor == 0, floor == self.num_floors - 1,
+                True, lowest < floor, highest > floor, floor in dest_set,
+                num_down > 0, num_up > 0)
 
+    def getLegalActionsForSignature(signature):
+        (at_bottom, at_top, carrying, riders_down, riders_up, must_open,
+         can_open_down, can_open_up) = signature
+        # Default to physical limitations.
         # Never stall or change direction on a rider.
-        for rider in elevator['riders']:
-            dest, wait = rider
-            can_stall = False
-            if dest < elevator['floor']:
-                can_go_up = False
-            elif dest > elevator['floor']:
-                can_go_down = False
-            else:
-                must_open = True
-
-        # Don't do stupid things based on a rider waiting outside
-        # (Like open to go up if they're going down)
-        can_open_down = False
-        can_open_up = False
-        for dest, wait in self.waiting_riders[elevator['floor']]:
-            if dest < elevator['floor']:
-                can_open_down = True
-            if dest > elevator['floor']:
-                can_open_up = True
+        # (can_open_* come from the hall calls, so we don't do stupid things
+        # like open to go up if everyone waiting is going down)
+        can_stall = not carrying
+        can_go_down = not at_bottom and not riders_up
+        can_go_up = not at_top and not riders_down
 
         # generate final list
         actions = []
@@ -126,20 +431,8 @@ class GameState:
                 actions.remove("UP")
             if "DOWN" in actions:
                 actions.remove("DOWN")
-        return actions
-
-    # Maps a list of lists to a list of selections from each list.
-    def getCombinations(self, lists):
-        if len(lists) == 0:
-            return [[]]
-        combinations = []
-        # Combine things in the first list with every combinations of the rest.
-        for suffix in self.getCombinations(lists[1:]):
-            for prefix in lists[0]:
-                combination = [prefix]
-                combination.extend(suffix)
-                combinations.append(combination)
-        return combinations
+        return tuple(actions)
+    getLegalActionsForSignature = staticmethod(getLegalActionsForSignature)
 
     # ignore the "agentIndex" part--that's to keep the legacy agents happy
     # while passing in parameters
@@ -148,95 +441,230 @@ class GameState:
         Returns the legal actions for the agent specified.
         """
         # note that a single "action" actually describes the actions for
-        # all elevators--thus the need to generate all possible permutations
-        lists = self.getCombinations(map(self.getLegalActionsForSingleElevator,
-                                         range(self.num_elevators)))
-        # pass tuples so actions can be hashed
-        return [tuple(action_list) for action_list in lists]
+        # all elevators--JointActions stands in for all the possible
+        # permutations without building them (actions are hashable tuples)
+        return JointActions(map(self.getLegalActionsForSingleElevator,
+                                range(self.num_elevators)))
 
     def generateSuccessor(self, action):
         """
         Returns the successor state after the specified agent takes the action.
         """
-        successor = GameState(self)
-        successor.timestep += 1
+        successor = self.__class__(self)
+        successor.applyAction(action)
+        successor.makeReadOnly()
+        return successor
+
+    def generateNextState(self, action):
+        """
+        Returns the state the game moves on to after action. Unlike
+        generateSuccessor, the successor keeps drawing on this state's
+        arrivals, even a private stream, and recording its riders in this
+        state's rider stats, so only the game should call it.
+        """
+        successor = self.__class__(self)
+        successor.arrivals = self.arrivals
+        successor.rider_stats = self.rider_stats
+        successor.applyAction(action)
+        successor.makeReadOnly()
+        return successor
+
+    def applyAction(self, action):
+        """
+        Changes this state in place into its successor after action.
+        Only for states nobody else holds on to, like a simulation's own
+        copy: normally use generateSuccessor. While a checkpoint is open,
+        every change is journaled so restore can undo it.
+        """
+        if self._readonly:
+            raise Exception('This state is read-only: deepCopy it to get '
+                            'one to change')
+        journal = self._journal
+        if journal is not None:
+            journal.append((None, None, (self.timestep, self.score,
+                                         self.num_waiting, self.arrival_sum)))
+        self._elevators = self._waiting_riders = self._keys = None
+        self.timestep += 1
+        timestep = self.timestep
+        floors = self.elevator_floors
+        queues = self.waiting_queues
+        riders_list = self.elevator_riders
+        hall_calls = self.hall_calls
+        stats = self.rider_stats
+        if stats is not None:
+            add_wait, add_trip = stats.waits.add, stats.trips.add
         # Elevator logic.
-        for i in range(len(successor.elevators)):
-            elevator = successor.elevators[i]
+        for i in range(self.num_elevators):
             if action[i] == "UP":
-                elevator['floor'] += 1
+                if journal is not None:
+                    journal.append((floors, i, floors[i]))
+                floors[i] += 1
             elif action[i] == "DOWN":
-                elevator['floor'] -= 1
+                if journal is not None:
+                    journal.append((floors, i, floors[i]))
+                floors[i] -= 1
             elif action[i] == "OPEN_UP" or action[i] == "OPEN_DOWN":
+                floor = floors[i]
+                if journal is not None:
+                    journal.append((riders_list, i, riders_list[i]))
+                    journal.append((self.elevator_dests, i, self.elevator_dests[i]))
+                    journal.append((queues, floor, queues[floor]))
+                    journal.append((hall_calls, floor, hall_calls[floor]))
                 # Riders either get off or cause a waiting penalty.
-                updated_riders = []
-                for dest, wait in elevator['riders']:
-                    if dest != elevator['floor']:
-                        updated_riders.append((dest, wait + 1))
-                    successor.score -= wait + 1
-                elevator['riders'] = updated_riders
+                riders = []
+                for dest, wait, arrival in riders_list[i]:
+                    if dest != floor:
+                        riders.append((dest, wait + 1, arrival))
+                    elif stats is not None:
+                        add_trip(timestep - arrival)
+                    self.score -= wait + 1
                 # Waiting riders on the floor can get on.
+                # Their wait so far is measured up to the previous timestep.
+                going_up = action[i] == "OPEN_UP"
                 updated_waiting = []
-                for dest, wait in successor.waiting_riders[elevator['floor']]:
-                    if ((dest > elevator['floor']) == (action[i] == "OPEN_UP") and
-                            (len(elevator['riders']) < self.elevator_capacity)):
-                        elevator['riders'].append((dest, wait))
+                num_up, num_down = hall_calls[floor]
+                for dest, arrival in queues[floor]:
+                    if ((dest > floor) == going_up and
+                            len(riders) < self.elevator_capacity):
+                        riders.append((dest, timestep - 1 - arrival, arrival))
+                        if stats is not None:
+                            add_wait(timestep - 1 - arrival)
+                        self.num_waiting -= 1
+                        self.arrival_sum -= arrival
+                        if going_up:
+                            num_up -= 1
+                        else:
+                            num_down -= 1
                     else:
-                        updated_waiting.append((dest, wait))
-                successor.waiting_riders[elevator['floor']] = updated_waiting
-                elevator['riders'].sort(key=lambda x: -x[1])
-        # Update waiting passenger wait times.
-        for i in range(len(successor.waiting_riders)):
-            floor_list = successor.waiting_riders[i]
-            for j in range(len(floor_list)):
-                dest, wait = floor_list[j]
-                floor_list[j] = (dest, wait + 1)
-                successor.score -= (wait + 1)
+                        updated_waiting.append((dest, arrival))
+                queues[floor] = tuple(updated_waiting)
+                hall_calls[floor] = (num_up, num_down)
+                riders.sort(key=lambda x: -x[1])
+                riders_list[i] = tuple(riders)
+                if riders:
+                    dests = [dest for dest, _, _ in riders]
+                    self.elevator_dests[i] = (min(dests), max(dests),
+                                              frozenset(dests))
+                else:
+                    self.elevator_dests[i] = None
+        # Waiting passengers each cost their wait time (timestep - arrival),
+        # so the sum over everyone still waiting comes from the totals.
+        self.score -= self.num_waiting * timestep - self.arrival_sum
         # Add new arrivals.
-        for src, dest in successor.generateArrivals(successor.timestep):
-            successor.waiting_riders[src].append((dest, 0))
-        # maintain sort invariant for correct hashing
-        for i in range(len(successor.waiting_riders)):
-            # sort by wait time, decreasing
-            floor_list.sort(key=lambda x: -x[1])
-        return successor
+        # Appending keeps every floor sorted by arrival time, which is
+        # needed for correct hashing.
+        arrivals = [[] for _ in range(self.num_floors)]
+        for src, dest in self.generateArrivals(timestep):
+            arrivals[src].append((dest, timestep))
+        for i in range(self.num_floors):
+            if arrivals[i]:
+                if journal is not None:
+                    journal.append((queues, i, queues[i]))
+                    journal.append((hall_calls, i, hall_calls[i]))
+                queues[i] += tuple(arrivals[i])
+                self.num_waiting += len(arrivals[i])
+                self.arrival_sum += len(arrivals[i]) * timestep
+                num_up, num_down = hall_calls[i]
+                for dest, _ in arrivals[i]:
+                    if dest > i:
+                        num_up += 1
+                    else:
+                        num_down += 1
+                hall_calls[i] = (num_up, num_down)
+
+    def checkpoint(self):
+        """
+        Starts journaling changes made by applyAction (if not already) and
+        returns a mark that restore can roll this state back to.
+        """
+        if self._journal is None:
+            self._journal = []
+        return len(self._journal)
+
+    def restore(self, mark):
+        """
+        Undoes every applyAction since checkpoint returned mark.
+        """
+        journal = self._journal
+        while len(journal) > mark:
+            values, index, old = journal.pop()
+            if values is None:
+                self.timestep, self.score, self.num_waiting, self.arrival_sum = old
+            else:
+                values[index] = old
+        self._elevators = self._waiting_riders = self._keys = None
+
+    def resampleArrivals(self, chunk_size=1024):
+        """
+        Gives this state its own, freshly sampled future arrivals
+        (see getSimulationState).
+        """
+        self.arrivals = ArrivalStream(self.num_floors, self.traffic,
+                                      chunk_size=chunk_size,
+                                      start=self.timestep + 1)
 
     def getScore(self):
         # see generateSuccessor
         return float(self.score)
 
-    def generateArrivals(self, timestep):
-        # TODO: possible extension--non-constant lambdas
-        lGroundSource = self.traffic  # maybe exponential decay from time: 0 to end?
-        lGroundDest = self.traffic  # maybe exponential decay from time: end to 0?
-        lRandom = self.traffic  # maybe constant?
+    # chunk size of the streams copies sample when they first need one
+    COPY_CHUNK_SIZE = 64
 
-        # lots of riders are arriving at the ground: lambda = #/timestep
-        groundSource = [(0, random.randint(1, self.num_floors-1))
-                        for _ in range(poisson(lGroundSource))]
-        # lots of riders also want to get to the ground: lambda = #/timestep
-        groundDest = [(random.randint(1, self.num_floors-1), 0)
-                      for _ in range(poisson(lGroundDest))]
-        # lots of random other movement throughout
-        randomRiders = []
-        for _ in range(poisson(lRandom)):
-            source = random.randint(0, self.num_floors-1)
-            while True:
-                dest = random.randint(0, self.num_floors-1)
-                if dest != source:
-                    break
-            randomRiders += [(source, dest)]
-        # combine all three!
-        return groundSource + groundDest + randomRiders
+    def generateArrivals(self, timestep):
+        # see ArrivalStream: a state past the end of its stream's chunk,
+        # or without one (see __init__), moves on to a stream of its own
+        arrivals = self.arrivals
+        if arrivals is None:
+            arrivals = self.arrivals = ArrivalStream(
+                self.num_floors, self.traffic, self.COPY_CHUNK_SIZE, timestep)
+        elif not arrivals.hasTimestep(timestep):
+            arrivals = self.arrivals = arrivals.getNextStream(timestep)
+        return arrivals.getArrivals(timestep)
 
     def deepCopy(self):
-        state = GameState(self)
+        # the rider tuples are immutable, so copying the containers is enough
+        return self.__class__(self)
+
+    def makeReadOnly(self):
+        """
+        Turns this state's containers into tuples, so nothing can change
+        it any more; applyAction refuses to.
+        """
+        self.elevator_floors = tuple(self.elevator_floors)
+        self.elevator_riders = tuple(self.elevator_riders)
+        self.waiting_queues = tuple(self.waiting_queues)
+        self.elevator_dests = tuple(self.elevator_dests)
+        self.hall_calls = tuple(self.hall_calls)
+        self._journal = None
+        self._readonly = True
+
+    def getReadOnlyView(self):
+        """
+        Returns this state for the game to show agents, which can keep it
+        as long as they like without anything they do reaching the game.
+        Successors are read-only already, so they're their own views;
+        only a state still made of lists (like a game's first) is copied.
+        """
+        if self._readonly:
+            return self
+        return self.__class__(self, readonly=True)
+
+    def getSimulationState(self, chunk_size=1024):
+        """
+        Returns a copy of this state with its own, freshly sampled future
+        arrivals, for planners to simulate from without peeking at the
+        arrivals the real game is going to see.
+        """
+        state = self.deepCopy()
+        state.resampleArrivals(chunk_size)
         return state
 
     def __init__(self, prev_state=None, num_elevators=1, num_floors=10,
-                 capacity=20, traffic=0.25):
+                 capacity=20, traffic=0.25, arrivals=None, rider_stats=None,
+                 readonly=False):
         """
         Generates a new state by copying information from its predecessor.
+        A readonly copy keeps its containers in tuples (see getReadOnlyView).
         """
 
         if prev_state is not None:
@@ -244,49 +672,159 @@ class GameState:
             self.num_elevators = prev_state.num_elevators
             self.num_floors = prev_state.num_floors
             self.elevator_capacity = prev_state.elevator_capacity
-            self.generate_arrivals = prev_state.generate_arrivals
+            # the arrival stream is shared, unless it's a game's private
+            # one: then this copy samples its own when it first needs
+            # arrivals (see generateArrivals)
+            arrivals = prev_state.arrivals
+            if arrivals is not None and arrivals.private:
+                arrivals = None
+            self.arrivals = arrivals
+            # the rider stats are only the game's (see generateNextState)
+            self.rider_stats = None
             # Simulation state.
+            # Only the containers are copied: the rider tuples are shared.
+            container = tuple if readonly else list
             self.timestep = prev_state.timestep
-            self.elevators = copy.deepcopy(prev_state.elevators)
-            self.waiting_riders = copy.deepcopy(prev_state.waiting_riders)
+            self.elevator_floors = container(prev_state.elevator_floors)
+            self.elevator_riders = container(prev_state.elevator_riders)
+            self.waiting_queues = container(prev_state.waiting_queues)
+            self.elevator_dests = container(prev_state.elevator_dests)
+            self.hall_calls = container(prev_state.hall_calls)
+            self.num_waiting = prev_state.num_waiting
+            self.arrival_sum = prev_state.arrival_sum
             self.score = prev_state.score
             self.traffic = prev_state.traffic
         else:
             self.num_elevators = num_elevators
             self.num_floors = num_floors
             self.elevator_capacity = capacity
-            self.generate_arrivals = lambda timestep: [(0, 5)]
+            if arrivals is None:
+                arrivals = ArrivalStream(num_floors, traffic)
+            self.arrivals = arrivals
+            self.rider_stats = rider_stats
             self.timestep = 0
-            # each rider is (destination, waittime) tuple
+            # each waiting rider is (destination, arrival timestep) tuple
+            # riders in elevators also carry the wait they are charged for
             # source is unnecessary since it doesn't matter for riders in elev.
-            # and waiting_riders contain it in the index
-            self.elevators = [{"floor": 0, "riders": []} for _ in range(num_elevators)]
-            # index of waiting_riders = floor
-            self.waiting_riders = [[] for _ in range(self.num_floors)]
+            # and waiting_queues contain it in the index
+            self.elevator_floors = [0] * num_elevators
+            self.elevator_riders = [()] * num_elevators
+            # index of waiting_queues = floor
+            self.waiting_queues = [()] * self.num_floors
+            # summaries used for legal actions (see getActionSignature):
+            # (lowest, highest, set of) dests per elevator, None if empty
+            self.elevator_dests = [None] * num_elevators
+            # (number going up, number going down) waiting per floor
+            self.hall_calls = [(0, 0)] * self.num_floors
+            self.num_waiting = 0
+            self.arrival_sum = 0
             self.score = 0
             self.traffic = traffic
+        self._elevators = None
+        self._waiting_riders = None
+        self._keys = None
+        # undo journal for applyAction, see checkpoint
+        self._journal = None
+        self._readonly = readonly
+
+    def getStateKey(self, abstraction='exact'):
+        """
+        Returns the StateKey of this state under one of the
+        STATE_ABSTRACTIONS. Keys are cached, since states never change.
+        """
+        if self._keys is None:
+            self._keys = {}
+        elif abstraction in self._keys:
+            return self._keys[abstraction]
+        timestep = self.timestep
+        if abstraction == 'exact':
+            data = (timestep, self.score, tuple(self.elevator_floors),
+                    tuple(self.elevator_riders), tuple(self.waiting_queues))
+        elif abstraction == 'relative':
+            data = (tuple(self.elevator_floors),
+                    tuple([tuple([(dest, wait) for dest, wait, _ in riders])
+                           for riders in self.elevator_riders]),
+                    tuple([tuple([(dest, timestep - arrival)
+                                  for dest, arrival in queue])
+                           for queue in self.waiting_queues]))
+        elif abstraction == 'destinations':
+            data = (tuple(self.elevator_floors),
+                    tuple([tuple(sorted([dest for dest, _, _ in riders]))
+                           for riders in self.elevator_riders]),
+                    tuple([tuple([dest for dest, _ in queue])
+                           for queue in self.waiting_queues]))
+        elif abstraction == 'calls':
+            call_floors = [f for f, (num_up, num_down)
+                           in enumerate(self.hall_calls) if num_up or num_down]
+            elevators = []
+            for floor, dests in zip(self.elevator_floors, self.elevator_dests):
+                if dests is None:
+                    going, stopping = None, False
+                else:
+                    lowest, highest, dest_set = dests
+                    stopping = floor in dest_set
+                    if highest > floor:
+                        going = 'UP'
+                    elif lowest < floor:
+                        going = 'DOWN'
+                    else:
+                        going = 'HERE'
+                num_up, num_down = self.hall_calls[floor]
+                elevators.append((floor == 0, floor == self.num_floors - 1,
+                                  going, stopping, num_up > 0, num_down > 0,
+                                  bool(call_floors) and call_floors[-1] > floor,
+                                  bool(call_floors) and call_floors[0] < floor))
+            data = tuple(elevators)
+        else:
+            raise Exception('Unknown state abstraction: ' + str(abstraction))
+        key = StateKey(data)
+        self._keys[abstraction] = key
+        return key
+
+    def getElevatorStateKeys(self):
+        """
+        Returns a list with a StateKey per elevator of what that elevator
+        sees: its floor, the floors its riders are going to and which hall
+        calls are on. Used to factor Q-values by elevator. Cached like
+        getStateKey.
+        """
+        if self._keys is None:
+            self._keys = {}
+        elif 'elevators' in self._keys:
+            return self._keys['elevators']
+        calls = tuple([(num_up > 0, num_down > 0)
+                       for num_up, num_down in self.hall_calls])
+        keys = []
+        for i in range(self.num_elevators):
+            dests = self.elevator_dests[i]
+            if dests is not None:
+                dests = tuple(sorted(dests[2]))
+            keys.append(StateKey((self.elevator_floors[i], dests, calls)))
+        self._keys['elevators'] = keys
+        return keys
 
     def __hash__(self):
         """
         Allows states to be keys of dictionaries.
         """
-        data = [self.timestep, self.score]
-        for elevator in self.elevators:
-            data.append(elevator['floor'])
-            data.append(tuple(elevator['riders']))
-        for rider_list in self.waiting_riders:
-            data.append(tuple(rider_list))
-        return hash(tuple(data))
+        return hash(self.getStateKey())
+
+    def __eq__(self, other):
+        return (isinstance(other, GameState) and
+                self.getStateKey() == other.getStateKey())
+
+    def __ne__(self, other):
+        return not self == other
 
     def __str__(self):
         stats = 'Time: %d, Score: %d\n' % (self.timestep, self.score)
         elevators = ""
         for i in range(self.num_elevators):
-            e = self.elevators[i]
             elevators += ("El. %d: Floor (%d), Riders (%d)\n" %
-                          (i, e['floor'], len(e['riders'])))
+                          (i, self.elevator_floors[i],
+                           len(self.elevator_riders[i])))
         riders = ('Riders/floor: ' +
-                  str([len(floor) for floor in self.waiting_riders]))
+                  str([len(floor) for floor in self.waiting_queues]))
         return stats + elevators + riders
 
 
@@ -335,7 +873,8 @@ def readCommand(argv):
     parser.add_option('-q', '--quiet', action='store_true', dest='quiet',
                       help=default('Silence the game state reports?'), default=False)
     parser.add_option('-a', '--agentType', dest='agentType',
-                      help=default('Which agent to run?'), default='naive')
+                      help=default('Which agent to run? (naive, rl, factored, approx, monte, mcts)'),
+                      default='naive')
     parser.add_option('-e', '--numElevators', dest='numElevators',
                       help=default('How many elevators?'), default=4)
     parser.add_option('-x', '--numFloors', dest='numFloors',
@@ -344,12 +883,108 @@ def readCommand(argv):
                       help=default('Capacity per elevator?'), default=20)
     parser.add_option('-z', '--traffic', dest='traffic',
                       help=default('Poisson lambda for traffic?'), default=0.25)
+    parser.add_option('-w', '--workers', dest='workers', type='int',
+                      help=default('How many processes to run evaluation '
+                                   'episodes on? (workers are silent, so '
+                                   'only per-episode scores are reported)'),
+                      default=1)
+    parser.add_option('--rollouts', dest='numRollouts', type='int',
+                      help=default('How many Monte Carlo rollouts per decision?'),
+                      default=100)
+    parser.add_option('--depth', dest='rolloutDepth', type='int',
+                      help=default('How many random steps per Monte Carlo rollout?'),
+                      default=10)
+    parser.add_option('--timeLimit', dest='timeLimit', type='float',
+                      help='Seconds per Monte Carlo decision (keeps rolling '
+                           'out until the time is up, instead of using --rollouts)',
+                      default=None)
+    parser.add_option('--futures', dest='numFutures', type='int',
+                      help='Play every first action of a Monte Carlo '
+                           'decision against this many shared futures '
+                           '(common random numbers), instead of --rollouts '
+                           'independent rollouts',
+                      default=None)
+    parser.add_option('--allocation', dest='allocation',
+                      help=default('How to spread Monte Carlo rollouts over '
+                                   'first actions? (' +
+                                   ', '.join(MonteCarloPlanner.ALLOCATIONS) + ')'),
+                      default='uniform')
+    parser.add_option('--perElevatorQ', action='store_true', dest='perElevatorQ',
+                      help='Give every elevator its own Q-values in the '
+                           'factored agent, instead of sharing them',
+                      default=False)
+    parser.add_option('--qTable', dest='qTable', metavar='PATH',
+                      help='Keep the Q-values of the rl and factored agents '
+                           'in a table memory-mapped from files at PATH '
+                           '(overwritten, and saved after training; with '
+                           '--resume or --loadPolicy, the checkpoint\'s '
+                           'values are written there)',
+                      default=None)
+    parser.add_option('--replay', dest='replay', type='int',
+                      help=default('How many past transitions the RL agents '
+                                   'keep to learn from again (0: learn from '
+                                   'each step once)'),
+                      default=0)
+    parser.add_option('--replayBatch', dest='replayBatch', type='int',
+                      help=default('Transitions replayed per step'),
+                      default=32)
+    parser.add_option('--prioritized', action='store_true', dest='prioritized',
+                      help='Replay transitions in proportion to their last '
+                           'TD error, instead of uniformly',
+                      default=False)
+    parser.add_option('--results', dest='results', metavar='PATH',
+                      help='Append a record of every episode to PATH, as CSV '
+                           'if it ends in .csv or else as JSON lines',
+                      default=None)
+    parser.add_option('--checkpoint', dest='checkpoint', metavar='PATH',
+                      help='Save RL training checkpoints to PATH',
+                      default=None)
+    parser.add_option('--checkpointEvery', dest='checkpointEvery', type='int',
+                      help=default('Training episodes between checkpoints'),
+                      default=25)
+    parser.add_option('--resume', dest='resume', metavar='PATH',
+                      help='Continue RL training from the checkpoint at PATH '
+                           '(and keep checkpointing to it, unless '
+                           '--checkpoint says otherwise)',
+                      default=None)
+    parser.add_option('--loadPolicy', '--load-policy', dest='loadPolicy',
+                      metavar='PATH',
+                      help='Evaluate the RL values from the checkpoint at '
+                           'PATH, without any training',
+                      default=None)
+    parser.add_option('--maxNodes', dest='maxNodes', type='int',
+                      help=default('Most tree nodes the mcts agent keeps?'),
+                      default=100000)
+    parser.add_option('--rolloutWorkers', dest='rolloutWorkers', type='int',
+                      help=default('How many processes to run each Monte Carlo '
+                                   'decision\'s rollouts on? (only used '
+                                   'with a single --workers)'),
+                      default=1)
+    parser.add_option('--profile', action='store_true', dest='profile',
+                      help='Time every phase of a step (the agent\'s '
+                           'decision, learning updates, state updates, '
+                           'arrivals) and end with a table of where the '
+                           'time went',
+                      default=False)
+    parser.add_option('--profileDump', dest='profileDump', metavar='PREFIX',
+                      help='Run under cProfile and save its stats to '
+                           'PREFIX.<agent>.pstats, for pstats or a viewer '
+                           '(only this process is profiled, not --workers)',
+                      default=None)
+    parser.add_option('--abstraction', dest='abstraction',
+                      help=default('State abstraction for RL Q-values? (' +
+                                   ', '.join(GameState.STATE_ABSTRACTIONS) + ')'),
+                      default='calls')
     # TODO: add more important properties
     # see init in GameState
 
     options, otherjunk = parser.parse_args(argv)
     if len(otherjunk) != 0:
         raise Exception('Command line input not understood: ' + str(otherjunk))
+    # the buffer has to hold a batch before anything is learned from it
+    if 0 < options.replay < options.replayBatch:
+        raise Exception('--replay (%d) can not be smaller than --replayBatch '
+                        '(%d)' % (options.replay, options.replayBatch))
     args = dict()
 
     # Fix the random seed
@@ -364,93 +999,713 @@ def readCommand(argv):
     args['agentType'] = options.agentType
     args['numElevators'] = int(options.numElevators)
     args['numFloors'] = int(options.numFloors)
-    args['capacity'] = options.capacity
-    args['traffic'] = options.traffic
+    args['capacity'] = int(options.capacity)
+    args['traffic'] = float(options.traffic)
+    args['abstraction'] = options.abstraction
+    args['workers'] = options.workers
+    args['rolloutWorkers'] = options.rolloutWorkers
+    args['numRollouts'] = options.numRollouts
+    args['rolloutDepth'] = options.rolloutDepth
+    args['timeLimit'] = options.timeLimit
+    args['maxNodes'] = options.maxNodes
+    args['numFutures'] = options.numFutures
+    args['allocation'] = options.allocation
+    args['perElevatorQ'] = options.perElevatorQ
+    args['qTable'] = options.qTable
+    args['replay'] = options.replay
+    args['replayBatch'] = options.replayBatch
+    args['prioritized'] = options.prioritized
+    args['results'] = options.results
+    args['checkpoint'] = options.checkpoint
+    args['checkpointEvery'] = options.checkpointEvery
+    args['resume'] = options.resume
+    args['loadPolicy'] = options.loadPolicy
+    args['profile'] = options.profile
+    # taken out again in __main__, which does the cProfile run
+    args['profileDump'] = options.profileDump
     return args
 
 
+def getPrunedActions(state, prev_action, rng=random):
+    """
+    Legal actions for Monte Carlo search, mostly keeping elevators that
+    were moving going in the same direction. rng is where the random
+    decision to prune comes from.
+    """
+    actions = state.getLegalActions()
+    if prev_action == None or rng.random() > 0.8:
+        return actions
+    # Keep moving elevators moving, unless they could open instead.
+    # Works on the per-elevator lists, so the product is never built.
+    elevator_actions = actions.elevator_actions[:]
+    for i in range(len(prev_action)):
+        if prev_action[i] == "UP" or prev_action[i] == "DOWN":
+            if ("OPEN_UP" in elevator_actions[i] or
+                    "OPEN_DOWN" in elevator_actions[i]):
+                continue
+            if prev_action[i] not in elevator_actions[i]:
+                # nothing would be left, so don't prune at all
+                return actions
+            elevator_actions[i] = [prev_action[i]]
+    return JointActions(elevator_actions)
+
+def runRollouts(state, actions, num_rollouts=100, depth=10):
+    """
+    Runs num_rollouts random rollouts from state, each starting with a
+    random one of actions and then playing depth more random steps.
+
+    Returns a dict of first action => [rollouts, total score, best score,
+    index of the rollout that first got the best score], which is all
+    the search needs, so it's cheap to send back from a worker process.
+    """
+    results = {}
+    # Simulations sample their own arrivals (1 + depth timesteps), and
+    # all share one copy of the state, stepped in place and rolled back.
+    sim_state = state.getSimulationState(chunk_size=depth + 1)
+    start = sim_state.checkpoint()
+    for n in range(num_rollouts):
+        # Remember the first action.
+        first_action = random.choice(actions)
+        if n > 0:
+            sim_state.restore(start)
+            sim_state.resampleArrivals(chunk_size=depth + 1)
+        sim_state.applyAction(first_action)
+        action = None
+        for _ in range(depth):
+            action = random.choice(getPrunedActions(sim_state, action))
+            sim_state.applyAction(action)
+        score = sim_state.getScore()
+        if first_action not in results:
+            results[first_action] = [1, score, score, n]
+            continue
+        result = results[first_action]
+        result[0] += 1
+        result[1] += score
+        if score > result[2]:
+            result[2] = score
+            result[3] = n
+    return results
+
+def runCommonRollouts(state, actions, num_futures=10, depth=10):
+    """
+    Common random numbers: samples num_futures futures from state (the
+    arrivals and the rollout policy's random choices for 1 + depth steps)
+    and plays every one of actions against each of them, so differences
+    between first actions aren't buried in arrival noise.
+
+    Returns a dict of first action => list of its scores, one per future,
+    in the same order for every action.
+    """
+    futures = [(ArrivalStream(state.num_floors, state.traffic,
+                              chunk_size=depth + 1, start=state.timestep + 1),
+                random.randint(0, 2 ** 30))
+               for _ in range(num_futures)]
+    results = dict([(action, []) for action in actions])
+    sim_state = state.deepCopy()
+    start = sim_state.checkpoint()
+    for arrivals, policy_seed in futures:
+        for first_action in actions:
+            sim_state.restore(start)
+            # the whole future fits in one chunk, so it's never resampled
+            sim_state.arrivals = arrivals
+            rng = random.Random(policy_seed)
+            sim_state.applyAction(first_action)
+            action = None
+            for _ in range(depth):
+                action = rng.choice(getPrunedActions(sim_state, action, rng))
+                sim_state.applyAction(action)
+            results[first_action].append(sim_state.getScore())
+    return results
+
+def getCommonVariances(results):
+    """
+    For results from runCommonRollouts, compares the action with the best
+    mean score to every other action, and returns the variance of a
+    single score difference (summed over those comparisons) both as
+    measured on the shared futures and as it would be with independent
+    rollouts, i.e. the sum of the two actions' own variances.
+    """
+    if len(results) < 2 or len(results.values()[0]) < 2:
+        return 0.0, 0.0
+    scores = dict([(action, numpy.array(action_scores))
+                   for action, action_scores in results.items()])
+    best = max(scores, key=lambda action: scores[action].mean())
+    paired = independent = 0.0
+    for action in scores:
+        if action != best:
+            paired += (scores[best] - scores[action]).var(ddof=1)
+            independent += scores[best].var(ddof=1) + scores[action].var(ddof=1)
+    return paired, independent
+
+def mergeRollouts(results, more_results, offset):
+    """
+    Adds the rollouts in more_results (as returned by runRollouts, with
+    rollout indices shifted by offset) into results.
+    """
+    for first_action, (count, total, best, index) in more_results.items():
+        if first_action not in results:
+            results[first_action] = [count, total, best, index + offset]
+            continue
+        result = results[first_action]
+        result[0] += count
+        result[1] += total
+        if best > result[2] or (best == result[2] and index + offset < result[3]):
+            result[2] = best
+            result[3] = index + offset
+
+def mergeCommonRollouts(results, more_results, offset=None):
+    """
+    Adds the futures in more_results (as returned by runCommonRollouts)
+    after those in results.
+    """
+    for first_action, scores in more_results.items():
+        results.setdefault(first_action, []).extend(scores)
+
+def _runRolloutTask(task):
+    data, actions, num_rollouts, depth, task_seed, common = task
+    seedEpisode(task_seed)
+    if common:
+        return runCommonRollouts(cPickle.loads(data), actions, num_rollouts,
+                                 depth)
+    return runRollouts(cPickle.loads(data), actions, num_rollouts, depth)
+
+def runParallelRollouts(pool, workers, state, actions, num_rollouts=100,
+                        depth=10, common=False):
+    """
+    Same as runRollouts, but splits the rollouts between the workers of
+    pool. The state is serialized once and sent to each worker without
+    its arrivals, since rollouts sample their own.
+
+    With common set, num_rollouts is the number of futures instead, and
+    it's runCommonRollouts that the workers run.
+    """
+    root = state.deepCopy()
+    root.arrivals = None
+    data = cPickle.dumps(root, cPickle.HIGHEST_PROTOCOL)
+    sizes = [num_rollouts // workers + (1 if w < num_rollouts % workers else 0)
+             for w in range(workers)]
+    tasks = [(data, actions, size, depth, random.randint(0, 2 ** 30), common)
+             for size in sizes if size > 0]
+    merge = mergeCommonRollouts if common else mergeRollouts
+    results = {}
+    offset = 0
+    for task, task_results in zip(tasks, pool.map(_runRolloutTask, tasks)):
+        merge(results, task_results, offset)
+        offset += task[2]
+    return results
+
+class MonteCarloPlanner:
+    """
+    Picks actions by random rollouts: every candidate first action is
+    followed by depth random steps, and the action behind the best
+    rollout is taken.
+
+    - num_rollouts: rollouts per decision
+    - depth: random steps after the first action
+    - time_limit: if set, seconds per decision. The planner then works
+      anytime: it keeps running batches of batch_size rollouts until the
+      time is up (at least one batch) and ignores num_rollouts.
+    - workers: processes to spread rollouts over (see runParallelRollouts)
+    - num_futures: if set, uses common random numbers instead (see
+      runCommonRollouts): every candidate first action is played against
+      the same num_futures sampled futures, num_rollouts is ignored, and
+      the action with the best mean score is taken. With a time limit,
+      futures are added batch_size rollouts' worth at a time.
+    - allocation: 'uniform' spreads the rollouts over the first actions as
+      above; 'halving' uses successive halving instead (see planHalving),
+      ranking actions by mean score and spending most of the num_rollouts
+      (or time_limit) on the close contenders. num_futures is then
+      ignored.
+    """
+    ALLOCATIONS = ('uniform', 'halving')
+
+    def __init__(self, num_rollouts=100, depth=10, time_limit=None,
+                 workers=1, batch_size=10, num_futures=None,
+                 allocation='uniform'):
+        if allocation not in self.ALLOCATIONS:
+            raise Exception('Unknown rollout allocation: ' + str(allocation))
+        self.allocation = allocation
+        self.num_rollouts = num_rollouts
+        self.depth = depth
+        self.time_limit = time_limit
+        self.workers = workers
+        self.batch_size = batch_size
+        self.num_futures = num_futures
+        self.pool = None
+        # stats, e.g. to see how many rollouts fit in the time limit
+        self.num_decisions = 0
+        self.total_rollouts = 0
+        # time spent on (and number of) the rollouts successive halving
+        # has timed, to tell how many fit in the time limit
+        self.rollout_seconds = 0.0
+        self.rollouts_timed = 0
+        # variances of score differences, see getVarianceReduction
+        self.paired_variance = 0.0
+        self.independent_variance = 0.0
+        self.startEpisode()
+
+    def startEpisode(self):
+        self.prev_action = None
+
+    def close(self):
+        """
+        Shuts down the worker pool, if any. It's started again when needed.
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def startPool(self):
+        if self.workers > 1 and self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers)
+
+    def runBatch(self, state, actions, num_rollouts, common=None):
+        if common is None:
+            common = self.num_futures is not None
+        if self.workers <= 1:
+            if common:
+                return runCommonRollouts(state, actions, num_rollouts,
+                                         self.depth)
+            return runRollouts(state, actions, num_rollouts, self.depth)
+        self.startPool()
+        return runParallelRollouts(self.pool, self.workers, state, actions,
+                                   num_rollouts, self.depth, common)
+
+    def plan(self, state, actions):
+        """
+        Returns the rollout results (see runRollouts, or runCommonRollouts
+        with num_futures set) for actions in state.
+        """
+        if self.num_futures is not None:
+            merge = mergeCommonRollouts
+            num_rollouts = self.num_futures
+            batch_size = max(self.batch_size // len(actions), 1)
+        else:
+            merge = mergeRollouts
+            num_rollouts = self.num_rollouts
+            batch_size = self.batch_size
+        if self.time_limit is None:
+            return self.runBatch(state, actions, num_rollouts)
+        deadline = time.time() + self.time_limit
+        batch_size *= max(self.workers, 1)
+        results = {}
+        done = 0
+        while done == 0 or time.time() < deadline:
+            merge(results, self.runBatch(state, actions, batch_size), done)
+            done += batch_size
+        return results
+
+    def getRolloutSeconds(self):
+        """
+        Seconds a rollout has taken on average in successive halving.
+        """
+        return self.rollout_seconds / self.rollouts_timed
+
+    def runTimedBatch(self, results, state, actions, per_action):
+        """
+        Adds per_action rollouts of each of actions on shared futures to
+        results, timing them for getRolloutSeconds.
+        """
+        self.startPool()
+        start = time.time()
+        mergeCommonRollouts(results, self.runBatch(state, actions, per_action,
+                                                   common=True))
+        self.rollout_seconds += time.time() - start
+        self.rollouts_timed += per_action * len(actions)
+
+    def getHalvingCandidates(self, actions, budget):
+        """
+        All of actions if successive halving can give every one of them
+        a rollout in each of its rounds within budget rollouts, and as
+        many as it can (two at least) picked at random otherwise.
+        """
+        n = len(actions)
+        while n > 2 and n * int(math.ceil(math.log(n, 2))) > budget:
+            n -= 1
+        if n == len(actions):
+            return list(actions)
+        return random.sample(actions, n)
+
+    def planHalving(self, state, actions):
+        """
+        Successive halving: in each of ceil(log2(len(actions))) rounds,
+        every action still in the running gets the same number of
+        rollouts, on futures shared between them (see runCommonRollouts),
+        and the worse half by mean score so far is dropped. Each round
+        gets an equal share of num_rollouts, or of time_limit if set.
+
+        Both are budgets, not targets: when there are too many actions
+        for each to get a rollout in every round, only some of them are
+        planned for (see getHalvingCandidates). With a time limit, the
+        budget in rollouts comes from how long rollouts have taken so
+        far (a single one is timed first if none have been), no batch is
+        started that the round's time left can't cover, and once the
+        time is up the survivor with the best mean so far is taken.
+
+        Returns the rollout results and the action left at the end.
+        """
+        start = time.time()
+        results = {}
+        if self.time_limit is None:
+            budget = self.num_rollouts
+        else:
+            if self.rollouts_timed == 0:
+                self.runTimedBatch(results, state, [random.choice(actions)], 1)
+            budget = int(self.time_limit / self.getRolloutSeconds())
+        survivors = self.getHalvingCandidates(actions, budget)
+        num_rounds = int(math.ceil(math.log(len(survivors), 2)))
+        for r in range(num_rounds):
+            if self.time_limit is None:
+                per_action = max(self.num_rollouts //
+                                 (len(survivors) * num_rounds), 1)
+                mergeCommonRollouts(results, self.runBatch(
+                    state, survivors, per_action, common=True))
+            else:
+                if r > 0 and time.time() >= start + self.time_limit:
+                    break
+                deadline = start + self.time_limit * (r + 1) / num_rounds
+                done = 0
+                while True:
+                    # rollouts per survivor the time left still covers
+                    fits = int((deadline - time.time()) /
+                               (self.getRolloutSeconds() * len(survivors)))
+                    per_action = min(max(self.batch_size // len(survivors), 1) *
+                                     max(self.workers, 1), fits)
+                    if per_action < 1:
+                        # but the first round scores every candidate
+                        if r > 0 or done > 0:
+                            break
+                        per_action = 1
+                    self.runTimedBatch(results, state, survivors, per_action)
+                    done += per_action
+            # sorting is stable, so ties keep the order of actions
+            survivors.sort(key=lambda a: -sum(results[a]) / len(results[a]))
+            survivors = survivors[:(len(survivors) + 1) // 2]
+        return results, survivors[0]
+
+    def getAction(self, state):
+        actions = getPrunedActions(state, self.prev_action)
+        if len(actions) == 1:
+            self.prev_action = actions[0]
+            return self.prev_action
+        if self.allocation == 'halving':
+            results, self.prev_action = self.planHalving(state, actions)
+            self.num_decisions += 1
+            self.total_rollouts += sum(map(len, results.values()))
+            return self.prev_action
+        results = self.plan(state, actions)
+        self.num_decisions += 1
+        if self.num_futures is not None:
+            self.total_rollouts += sum(map(len, results.values()))
+            paired, independent = getCommonVariances(results)
+            self.paired_variance += paired
+            self.independent_variance += independent
+            # Take the action with the best mean (the first one on ties).
+            order = dict([(action, i) for i, action in enumerate(actions)])
+            self.prev_action = min(results, key=lambda a: (
+                -sum(results[a]) / len(results[a]), order[a]))
+            return self.prev_action
+        self.total_rollouts += sum([result[0] for result in results.values()])
+        # Take the action with the best rollout (the earliest one on ties).
+        self.prev_action = min(results, key=lambda a: (-results[a][2],
+                                                       results[a][3]))
+        return self.prev_action
+
+    def getVarianceReduction(self):
+        """
+        With num_futures set: how many times larger the variance of the
+        score difference between the best and the other actions would be
+        with independent rollouts than on the shared futures, over all
+        decisions so far. That's also how many times more rollouts
+        independent sampling needs to tell the actions apart as well.
+        """
+        if self.paired_variance <= 0:
+            return None
+        return self.independent_variance / self.paired_variance
+
 def runMonteCarlo(num_timesteps=100, num_elevators=1, num_floors=10,
-                  capacity=20, traffic=0.25):
+                  capacity=20, traffic=0.25, planner=None, rider_stats=None,
+                  profiler=None):
     """
     Run a Monte Carlo simulation of elevators.
     Differs in output from the standard game driver, but
     relies on the same GameState and obeys the same logic.
+
+    Decisions are made by planner, a MonteCarloPlanner with the default
+    parameters if not given. If given a RiderStats, the episode's riders
+    are recorded in it, and if given a PhaseProfiler, the planner's
+    decisions and the state updates are timed with it (see Game.run).
     """
-    def getPrunedActions(state, prev_action):
-        actions = state.getLegalActions()
-        if prev_action == None or random.random() > 0.8:
-            return actions
-        original_actions = actions[:]
-        for i in range(len(prev_action)):
-            if prev_action[i] == "UP" or prev_action[i] == "DOWN":
-                new_actions = []
-                keep_all = False
-                for j in range(len(actions)):
-                    if actions[j][i] == prev_action[i]:
-                        new_actions.append(actions[j])
-                    elif (actions[j][i] == "OPEN_UP" or
-                            actions[j][i] == "OPEN_DOWN"):
-                        keep_all = True
-                if not keep_all:
-                    actions = new_actions
-        if len(actions) > 0:
-            return actions
-        return original_actions
-
-    # Run to 100 timesteps.
+    if planner is None:
+        planner = MonteCarloPlanner()
+    # Run to num_timesteps timesteps.
     state = GameState(num_elevators=num_elevators, num_floors=num_floors,
-                      capacity=capacity, traffic=traffic)
-    prev_action = None
-
-    while state.timestep < num_timesteps:
-        actions = getPrunedActions(state, prev_action)
-        if len(actions) == 1:
-            state = state.generateSuccessor(actions[0])
-            prev_action = actions[0]
-        else:
-            best_score = None
-            best_action = None
-            # TODO: allow passing of Monte Carlo sim. parameters
-            for _ in range(100):
-                # Remember the first action.
-                first_action = random.choice(actions)
-                sim_state = state.generateSuccessor(first_action)
-                # Each simulation goes 20 timesteps out.
-                action = None
-                for _ in range(10):
-                    action = random.choice(getPrunedActions(sim_state, action))
-                    sim_state = sim_state.generateSuccessor(action)
-                if best_score == None or sim_state.getScore() > best_score:
-                    best_score = sim_state.getScore()
-                    best_action = first_action
-            # Take the best action.
-            state = state.generateSuccessor(best_action)
-            prev_action = best_action
+                      capacity=capacity, traffic=traffic,
+                      arrivals=ArrivalStream(num_floors, traffic,
+                                             chunk_size=num_timesteps + 1,
+                                             private=True),
+                      rider_stats=rider_stats)
+    decide = planner.getAction
+    successor = GameState.generateNextState
+    if profiler is not None:
+        start = time.time()
+        decide = profiler.timed('getAction', decide)
+        successor = profiler.timed('generateSuccessor', successor)
+        arrivals = state.arrivals
+        arrivals.getArrivals = profiler.timed('generateArrivals',
+                                              arrivals.getArrivals,
+                                              nested=True)
+    planner.startEpisode()
+    try:
+        while state.timestep < num_timesteps:
+            state = successor(state, decide(state))
+    finally:
+        planner.close()
+        if profiler is not None:
+            profiler.addTotal(time.time() - start)
+            del arrivals.getArrivals
     return state.getScore()
 
+def seedEpisode(episode_seed):
+    """
+    Seeds both random number generators the simulation uses.
+    """
+    random.seed(episode_seed)
+    seed(episode_seed)
+
+def getEpisodeSeeds(num_episodes):
+    """
+    Deterministic per-episode seeds, drawn once from the current random
+    state, so an episode plays out the same whichever process runs it.
+    """
+    base = random.randint(0, 2 ** 30)
+    return [base + i for i in range(num_episodes)]
+
+# what worker processes run, see runEpisodes
+_episode_runner = None
+
+def _runWorkerEpisode(episode_seed):
+    util.mutePrint()
+    seedEpisode(episode_seed)
+    result = _episode_runner()
+    # the agent stays behind in the parent process
+    # (results can also come with their time, see timeEpisode)
+    for part in (result if isinstance(result, tuple) else (result,)):
+        if isinstance(part, Game):
+            part.agent = None
+    return result
+
+def runEpisodes(runEpisode, seeds, workers=1):
+    """
+    Calls runEpisode() once per seed, after seeding with it, and yields
+    the results in seed order as soon as each is ready.
+
+    With more than one worker the episodes are spread over a pool of
+    processes. Workers are forked, so runEpisode (and whatever agent it
+    closes over) doesn't need to be picklable, but its result does.
+    """
+    if workers <= 1:
+        for episode_seed in seeds:
+            seedEpisode(episode_seed)
+            yield runEpisode()
+        return
+    global _episode_runner
+    _episode_runner = runEpisode
+    pool = multiprocessing.Pool(workers)
+    try:
+        for result in pool.imap(_runWorkerEpisode, seeds):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        _episode_runner = None
+
+def timeEpisode(runEpisode):
+    """
+    Wraps runEpisode so it returns its result along with the seconds it
+    took (measured wherever it runs, so also in worker processes).
+    """
+    def runTimedEpisode():
+        start = time.time()
+        result = runEpisode()
+        return result, time.time() - start
+    return runTimedEpisode
+
+def getEpisodeRecord(config, phase, episode, seed, score, steps, seconds,
+                     rider_stats=None):
+    """
+    The record of one episode for a ResultsWriter: the run's config
+    plus what happened in the episode, including a summary of its
+    rider_stats if given.
+    """
+    record = dict(config)
+    record.update({'phase': phase, 'episode': episode, 'seed': seed,
+                   'score': score, 'steps': steps, 'seconds': seconds,
+                   'steps_per_sec': steps / seconds if seconds > 0 else None})
+    if rider_stats is not None:
+        record.update(rider_stats.getSummary())
+    return record
+
+def runGame(agent, numSteps, quiet, numElevators, numFloors, capacity, traffic,
+            profile=False):
+    """
+    Plays a single episode with agent and returns the finished Game.
+    Its state's rider_stats hold the episode's waits and trip times, and
+    with profile set, its profiler the time spent in each phase.
+    """
+    game = Game(agent)
+    if profile:
+        game.profiler = PhaseProfiler()
+    # sample the whole episode's arrivals up front
+    arrivals = ArrivalStream(numFloors, traffic, chunk_size=numSteps + 2,
+                             private=True)
+    game.state = GameState(num_elevators=numElevators, num_floors=numFloors,
+                           capacity=capacity, traffic=traffic,
+                           arrivals=arrivals, rider_stats=RiderStats())
+    game.run(numSteps, quiet)
+    return game
+
 def runGames(numGames, numTraining, numSteps, quiet, agentType, numElevators,
-             numFloors, capacity, traffic):
+             numFloors, capacity, traffic, abstraction='calls', workers=1,
+             rolloutWorkers=1, numRollouts=100, rolloutDepth=10, timeLimit=None,
+             maxNodes=100000, numFutures=None, allocation='uniform',
+             perElevatorQ=False, qTable=None, checkpoint=None,
+             checkpointEvery=25, resume=None, loadPolicy=None, replay=0,
+             replayBatch=32, prioritized=False, results=None, profile=False):
     """
     Main driver for running elevator simulations.
     Receives parameters from the command line and passes them to the
-    Monte Carlo, RL, or naive simulations.
+    Monte Carlo, RL (tabular or approximate), or naive simulations.
     If runnign RL or naive, then reports the average score.
+
+    Training episodes always run one after another, in this process;
+    evaluation episodes are each given their own seed and can be spread
+    over several worker processes.
+
+    RL agents save a checkpoint to checkpoint every checkpointEvery
+    training episodes (and when training ends). resume continues training
+    from a checkpoint; loadPolicy takes its values and skips training.
+
+    With results set, a record of every episode is appended to that
+    file as it finishes (see ResultsWriter), including its rider wait and
+    trip time quantiles; the quantiles over all evaluation episodes are
+    printed with the scores.
+
+    With profile set, every episode's steps are timed phase by phase (see
+    PhaseProfiler), and the run ends with the times over all episodes.
     """
 
     import __main__
 
     games = []
 
+    writer = None
+    if results is not None:
+        writer = ResultsWriter(results)
+    # worker processes can't start pools of their own
+    if workers > 1:
+        rolloutWorkers = 1
+    config = {'agent': agentType, 'numElevators': numElevators,
+              'numFloors': numFloors, 'capacity': capacity,
+              'traffic': traffic, 'numSteps': numSteps,
+              'numTraining': numTraining, 'workers': workers}
+    if agentType in ('monte', 'mcts'):
+        config.update({'numRollouts': numRollouts, 'depth': rolloutDepth,
+                       'timeLimit': timeLimit})
+    if agentType == 'monte':
+        config.update({'numFutures': numFutures, 'allocation': allocation,
+                       'rolloutWorkers': rolloutWorkers})
+    elif agentType == 'mcts':
+        config['maxNodes'] = maxNodes
+    elif agentType in ('rl', 'factored', 'approx'):
+        # a resumed run checkpoints to where it resumed from by default
+        config.update({'replay': replay, 'replayBatch': replayBatch,
+                       'prioritized': prioritized, 'qTable': qTable,
+                       'resume': resume, 'loadPolicy': loadPolicy,
+                       'checkpoint': checkpoint if checkpoint is not None
+                                     else resume})
+        if agentType == 'rl':
+            config['abstraction'] = abstraction
+        elif agentType == 'factored':
+            config['perElevatorQ'] = perElevatorQ
+
+    profiler = None
+    if profile:
+        profiler = PhaseProfiler()
+
+    table = None
+    if qTable is not None:
+        # refused before making the table, which overwrites its files
+        if agentType not in ('rl', 'factored'):
+            raise Exception('Only the rl and factored agents keep their '
+                            'Q-values in a --qTable')
+        if resume is None and loadPolicy is None:
+            table = QTable(qTable)
+
     if agentType == 'monte':
         scores = []
-        for i in range(100):
-            score = runMonteCarlo(num_elevators=numElevators, num_floors=numFloors,
-                         capacity=capacity, traffic=traffic)
+        planner = MonteCarloPlanner(num_rollouts=numRollouts,
+                                    depth=rolloutDepth, time_limit=timeLimit,
+                                    workers=rolloutWorkers,
+                                    num_futures=numFutures,
+                                    allocation=allocation)
+        def runEpisode():
+            stats = RiderStats()
+            episode_profiler = PhaseProfiler() if profile else None
+            score = runMonteCarlo(num_timesteps=numSteps,
+                                  num_elevators=numElevators,
+                                  num_floors=numFloors, capacity=capacity,
+                                  traffic=traffic, planner=planner,
+                                  rider_stats=stats,
+                                  profiler=episode_profiler)
+            return score, stats, episode_profiler
+        seeds = getEpisodeSeeds(numGames)
+        all_stats = RiderStats()
+        for i, ((score, stats, episode_profiler), seconds) in enumerate(
+                runEpisodes(timeEpisode(runEpisode), seeds, workers)):
             print 'Episode %d: score (%f)' % (i, score)
-        print scores
-        return
+            scores.append(score)
+            all_stats.merge(stats)
+            if profiler is not None:
+                profiler.merge(episode_profiler)
+            if writer is not None:
+                writer.write(getEpisodeRecord(config, 'test', i, seeds[i],
+                                              score, numSteps, seconds, stats))
+        if writer is not None:
+            writer.close()
+        print all_stats
+        print 'Average Score:', sum(scores) / float(len(scores))
+        print 'Scores:       ', ', '.join([str(score) for score in scores])
+        reduction = planner.getVarianceReduction()
+        if reduction is not None:
+            # (only known when episodes ran in this process)
+            print ('Common random numbers: variance of score differences '
+                   '%.1f%% of independent rollouts (%.1fx fewer rollouts)' %
+                   (100.0 / reduction, reduction))
+        if profiler is not None:
+            print 'Phase times over %d episodes:' % len(scores)
+            print profiler
+        return scores
     elif agentType == 'rl':
-        agent = QLearningAgent(numTraining=numTraining)
+        agent = QLearningAgent(numTraining=numTraining, abstraction=abstraction,
+                               table=table, replay=replay,
+                               replayBatch=replayBatch, prioritized=prioritized)
+    elif agentType == 'factored':
+        agent = FactoredQAgent(numTraining=numTraining,
+                               shared=not perElevatorQ, table=table,
+                               replay=replay, replayBatch=replayBatch,
+                               prioritized=prioritized)
+    elif agentType == 'approx':
+        agent = ApproximateQAgent(numTraining=numTraining, replay=replay,
+                                  replayBatch=replayBatch,
+                                  prioritized=prioritized)
+    elif agentType == 'mcts':
+        # rollouts per decision become simulations per decision
+        agent = MCTSAgent(num_simulations=numRollouts, depth=rolloutDepth,
+                          time_limit=timeLimit, max_nodes=maxNodes,
+                          rolloutFn=getPrunedActions)
     else:
         agent = NaiveAgent()
 
@@ -458,20 +1713,80 @@ def runGames(numGames, numTraining, numSteps, quiet, agentType, numElevators,
     # alpha    - learning rate (default 0.5)
     # epsilon  - exploration rate (default 0.5)
     # gamma    - discount factor (default 1)
-    for i in range(numGames + numTraining):
-        game = Game(agent)
-        game.state = GameState(num_elevators=numElevators, num_floors=numFloors,
-                               capacity=capacity, traffic=traffic)
-        game.run(numSteps, quiet)
-        if i >= numTraining:
-            games.append(game)
-            print 'Ran episode (%d/%d) of actual: score (%d)' % (i-numTraining+1, numGames, game.state.getScore())
+    start = 0
+    if resume is not None or loadPolicy is not None:
+        if not isinstance(agent, QLearningAgent):
+            raise Exception('Only the RL agents have checkpoints to load')
+        if resume is not None:
+            # carry on training, and checkpointing, where it stopped
+            agent.loadCheckpoint(resume)
+            start = min(agent.episodesSoFar, numTraining)
+            if checkpoint is None:
+                checkpoint = resume
         else:
-            print 'Ran (%d/%d) of training: score (%d)' % (i, numTraining, game.state.getScore())
+            agent.loadCheckpoint(loadPolicy, restoreRandom=False)
+            agent.stopTraining()
+            start = numTraining
+        # checkpoints load into memory; only an explicit --qTable puts
+        # their values in a file again
+        values = getattr(agent, 'values', None)
+        if qTable is not None and isinstance(values, QTable):
+            values.save(qTable)
+            agent.values = QTable.load(qTable, readonly=resume is None)
+    if checkpoint is not None and not isinstance(agent, QLearningAgent):
+        raise Exception('Only the RL agents can save checkpoints')
+    for i in range(start, numTraining):
+        episode_start = time.time()
+        game = runGame(agent, numSteps, quiet, numElevators, numFloors,
+                       capacity, traffic, profile)
+        if profiler is not None:
+            profiler.merge(game.profiler)
+        print 'Ran (%d/%d) of training: score (%d)' % (i, numTraining, game.state.getScore())
+        if writer is not None:
+            writer.write(getEpisodeRecord(config, 'training', i, None,
+                                          game.state.getScore(),
+                                          game.num_moves,
+                                          time.time() - episode_start,
+                                          game.state.rider_stats))
+        if checkpoint is not None and ((i + 1) % checkpointEvery == 0 or
+                                       i + 1 == numTraining):
+            agent.saveCheckpoint(checkpoint)
+    values = getattr(agent, 'values', None)
+    if (isinstance(values, QTable) and values.path is not None and
+            not values.readonly):
+        # once it's done learning, evaluation only reads the values, and
+        # workers share one mapping of them
+        values.save()
+        agent.values = QTable.load(values.path, readonly=agent.alpha == 0)
+
+    runEpisode = lambda: runGame(agent, numSteps, quiet, numElevators,
+                                 numFloors, capacity, traffic, profile)
+    seeds = getEpisodeSeeds(numGames)
+    all_stats = RiderStats()
+    for i, (game, seconds) in enumerate(runEpisodes(timeEpisode(runEpisode),
+                                                    seeds, workers)):
+        if game.agent is None:
+            game.agent = agent
+        games.append(game)
+        all_stats.merge(game.state.rider_stats)
+        if profiler is not None:
+            profiler.merge(game.profiler)
+        print 'Ran episode (%d/%d) of actual: score (%d)' % (i+1, numGames, game.state.getScore())
+        if writer is not None:
+            writer.write(getEpisodeRecord(config, 'test', i, seeds[i],
+                                          game.state.getScore(),
+                                          game.num_moves, seconds,
+                                          game.state.rider_stats))
+    if writer is not None:
+        writer.close()
 
+    print all_stats
     scores = [game.state.getScore() for game in games]
     print 'Average Score:', sum(scores) / float(len(scores))
     print 'Scores:       ', ', '.join([str(score) for score in scores])
+    if profiler is not None:
+        print 'Phase times over %d episodes:' % (len(games) + numTraining - start)
+        print profiler
     return games
 
 if __name__ == '__main__':
@@ -486,6 +1801,17 @@ if __name__ == '__main__':
     > python elevator.py --help
     """
     args = readCommand(sys.argv[1:])  # Get game components based on input
-    runGames(**args)
+    profileDump = args.pop('profileDump')
+    if profileDump is None:
+        runGames(**args)
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(runGames, **args)
+        finally:
+            path = '%s.%s.pstats' % (profileDump, args['agentType'])
+            profiler.dump_stats(path)
+            print 'cProfile stats saved to', path
 
     pass
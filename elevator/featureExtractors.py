@@ -0,0 +1,115 @@
+# featureExtractors.py
+# --------------------
+# Built from scratch, named after the feature extractors of the cs188 Pacman
+# project, which approximate Q-learning agents use the same way.
+#
+# Turns elevator states and actions into fixed-size numpy feature vectors,
+# so Q-values can be a weighted sum of features instead of a table entry
+# per state.
+
+import numpy
+
+class ElevatorFeatureExtractor:
+    """
+    Features of a (state, joint action) pair, in two parts:
+
+    - state features, the same for every action: a bias, the hall calls
+      per floor and direction, each elevator's floor and load, the longest
+      wait and the distance from each elevator to its nearest hall call
+    - action features of each elevator's own action, added up over the
+      elevators (so they share weights): riders dropped off and picked up,
+      moving toward riders' destinations or toward hall calls, stalling
+      while riders wait
+
+    Because the action part is a sum over elevators, the best joint action
+    under a linear Q-function is just the best action of each elevator,
+    and the joint actions never need to be listed (see getActionFeatures).
+
+    Everything is scaled to roughly [0, 1], so one learning rate fits all.
+    """
+    NUM_ACTION_FEATURES = 7
+
+    def __init__(self, num_elevators, num_floors, capacity):
+        self.num_elevators = num_elevators
+        self.num_floors = num_floors
+        self.capacity = capacity
+        self.num_state_features = 1 + 2 * num_floors + 3 * num_elevators + 1
+        self.num_features = self.num_state_features + self.NUM_ACTION_FEATURES
+
+    def getStateFeatures(self, state):
+        """
+        The state features as a numpy vector of num_state_features.
+        """
+        F = self.num_floors
+        E = self.num_elevators
+        features = numpy.zeros(self.num_state_features)
+        features[0] = 1.0
+        calls = numpy.array(state.hall_calls, dtype=float)
+        features[1:1 + 2 * F] = calls.ravel() / 10.0
+        floors = numpy.array(state.elevator_floors, dtype=float)
+        offset = 1 + 2 * F
+        features[offset:offset + E] = floors / max(F - 1, 1)
+        offset += E
+        features[offset:offset + E] = [len(riders) / float(self.capacity)
+                                       for riders in state.elevator_riders]
+        offset += E
+        call_floors = numpy.flatnonzero(calls.sum(1))
+        if len(call_floors):
+            distances = numpy.abs(floors[:, None] - call_floors[None, :])
+            features[offset:offset + E] = distances.min(1) / max(F - 1, 1)
+            # queues are in arrival order, so the first rider waited longest
+            oldest = min([queue[0][1] for queue in state.waiting_queues
+                          if queue])
+            features[offset + E] = (state.timestep - oldest) / 100.0
+        return features
+
+    def getActionFeatures(self, state, elevator_id, actions):
+        """
+        A (len(actions), NUM_ACTION_FEATURES) array with the action
+        features of each of actions for one elevator.
+        """
+        floor = state.elevator_floors[elevator_id]
+        riders = state.elevator_riders[elevator_id]
+        space = self.capacity - len(riders)
+        num_up, num_down = state.hall_calls[floor]
+        getting_off = len([1 for dest, _, _ in riders if dest == floor])
+        # riders can't be going both ways, see GameState.getLegalActions
+        riders_up = len([1 for dest, _, _ in riders if dest > floor])
+        riders_down = len(riders) - riders_up - getting_off
+        calls_above = calls_below = False
+        for f, (up, down) in enumerate(state.hall_calls):
+            if up or down:
+                if f > floor:
+                    calls_above = True
+                elif f < floor:
+                    calls_below = True
+        num_waiting = float(state.num_waiting)
+        scale = float(self.capacity)
+        features = numpy.zeros((len(actions), self.NUM_ACTION_FEATURES))
+        for k, action in enumerate(actions):
+            row = features[k]
+            if action == 'OPEN_UP' or action == 'OPEN_DOWN':
+                boarding = num_up if action == 'OPEN_UP' else num_down
+                row[0] = getting_off / scale
+                row[1] = min(boarding, space + getting_off) / scale
+                row[2] = 1.0
+            elif action == 'UP':
+                row[3] = riders_up / scale
+                row[4] = not riders and calls_above
+            elif action == 'DOWN':
+                row[3] = riders_down / scale
+                row[4] = not riders and calls_below
+            else:
+                row[5] = num_waiting / 10.0
+                row[6] = num_waiting == 0
+        return features
+
+    def getFeatures(self, state, action):
+        """
+        The full feature vector of a joint action in state.
+        """
+        action_features = numpy.zeros(self.NUM_ACTION_FEATURES)
+        for i in range(self.num_elevators):
+            action_features += self.getActionFeatures(state, i, [action[i]])[0]
+        return numpy.concatenate([self.getStateFeatures(state),
+                                  action_features])
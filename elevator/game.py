@@ -12,7 +12,7 @@
 
 
 from util import *
-import time, os
+import time, os, random
 import traceback
 import sys
 
@@ -37,6 +37,81 @@ class Agent:
         """
         raiseNotDefined()
 
+class JointActions:
+    """
+    The set of joint actions for all elevators, stored factored as one
+    list of legal actions per elevator instead of the full product.
+
+    Behaves like the list of action tuples it stands for (same order as
+    the old getCombinations: the first elevator varies fastest), so
+    len(), indexing, iteration, `in` and random.choice all work, but
+    nothing is built until asked for:
+    - len() and `in` never enumerate the product
+    - indexing decodes a single tuple, so random.choice is cheap
+    - iteration yields one tuple at a time
+    """
+    def __init__(self, elevator_actions):
+        self.elevator_actions = [list(actions) for actions in elevator_actions]
+        self.size = 1
+        for actions in self.elevator_actions:
+            self.size *= len(actions)
+
+    def getElevatorActions(self, elevator_id):
+        return self.elevator_actions[elevator_id]
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.size))]
+        if index < 0:
+            index += self.size
+        if index < 0 or index >= self.size:
+            raise IndexError('joint action index out of range')
+        # mixed radix, first elevator is the lowest digit
+        action = []
+        for actions in self.elevator_actions:
+            index, digit = divmod(index, len(actions))
+            action.append(actions[digit])
+        return tuple(action)
+
+    def __iter__(self):
+        if self.size == 0:
+            return
+        # odometer over the per-elevator lists, first elevator fastest
+        digits = [0] * len(self.elevator_actions)
+        action = [actions[0] for actions in self.elevator_actions]
+        while True:
+            yield tuple(action)
+            for i, actions in enumerate(self.elevator_actions):
+                digits[i] += 1
+                if digits[i] < len(actions):
+                    action[i] = actions[digits[i]]
+                    break
+                digits[i] = 0
+                action[i] = actions[0]
+            else:
+                return
+
+    def __contains__(self, action):
+        if len(action) != len(self.elevator_actions):
+            return False
+        for a, actions in zip(action, self.elevator_actions):
+            if a not in actions:
+                return False
+        return True
+
+    def sample(self):
+        """
+        Uniformly random joint action: one independent choice per elevator.
+        """
+        return tuple([random.choice(actions)
+                      for actions in self.elevator_actions])
+
+    def __repr__(self):
+        return 'JointActions(%r)' % self.elevator_actions
+
 ####################################
 # Parts you shouldn't have to read #
 ####################################
@@ -51,6 +126,8 @@ class Game:
         self.startingIndex = startingIndex
         self.gameOver = False
         self.moveHistory = []
+        # a PhaseProfiler to time the phases of run with, if any
+        self.profiler = None
         # below is implicitly set by elevator.py in runGames
         # self.state = some GameState()
 
@@ -66,28 +143,64 @@ class Game:
         """
         self.num_moves = 0
 
-        # inform learning agents of the game start
+        # the calls that make up a step, timed by the profiler if there is
+        # one (the learning update and arrival generation get timed inside
+        # the calls that make them)
         agent = self.agent
-        agent.registerInitialState(self.state.deepCopy())
-
-        while not self.gameOver:
-            # Generate an observation of the state
-            observation = agent.observationFunction(self.state.deepCopy())
-            if not quiet:
-                print observation
-            # Solicit an action
-            action = agent.getAction(observation)
-            # explicitly done in PacmanQLearningAgent
-            # but for some reason we need to do it here...very weird...
-            # (compare QLearningAgent.getAction and PacmanQLA.getAction)
-            agent.doAction(observation, action)
-            # Execute the action
-            self.moveHistory.append((0, action))
-            self.state = self.state.generateSuccessor(action)
-            # Track progress
-            self.num_moves += 1
-            if self.num_moves > num_steps:
-                self.gameOver = True
-
-        # inform a learning agent of the game result
-        agent.final(self.state)
+        observe = agent.observationFunction
+        decide = agent.getAction
+        doAction = agent.doAction
+        successor = self.state.__class__.generateNextState
+        final = agent.final
+        profiler = self.profiler
+        # (object, method name) of timed methods set on instances
+        timed_methods = []
+        if profiler is not None:
+            start = time.time()
+            observe = profiler.timed('observationFunction', observe)
+            decide = profiler.timed('getAction', decide)
+            doAction = profiler.timed('doAction', doAction)
+            successor = profiler.timed('generateSuccessor', successor)
+            final = profiler.timed('final', final)
+            for obj, name, phase in ((agent, 'update', 'update'),
+                                     (getattr(self.state, 'arrivals', None),
+                                      'getArrivals', 'generateArrivals')):
+                if (hasattr(obj, name) and hasattr(obj, '__dict__') and
+                        name not in obj.__dict__):
+                    setattr(obj, name, profiler.timed(phase, getattr(obj, name),
+                                                      nested=True))
+                    timed_methods.append((obj, name))
+
+        try:
+            # inform learning agents of the game start
+            # (agents are shown the game's own states, which are read-only,
+            # instead of copies; see GameState.getReadOnlyView)
+            agent.registerInitialState(self.state.getReadOnlyView())
+
+            while not self.gameOver:
+                # Generate an observation of the state
+                observation = observe(self.state.getReadOnlyView())
+                if not quiet:
+                    print observation
+                # Solicit an action
+                action = decide(observation)
+                # explicitly done in PacmanQLearningAgent
+                # but for some reason we need to do it here...very weird...
+                # (compare QLearningAgent.getAction and PacmanQLA.getAction)
+                doAction(observation, action)
+                # Execute the action
+                self.moveHistory.append((0, action))
+                self.state = successor(self.state, action)
+                # Track progress
+                self.num_moves += 1
+                if self.num_moves > num_steps:
+                    self.gameOver = True
+
+            # inform a learning agent of the game result
+            final(self.state)
+        finally:
+            if profiler is not None:
+                profiler.addTotal(time.time() - start)
+            # the timed wrappers can't be pickled, so they don't stay
+            for obj, name in timed_methods:
+                delattr(obj, name)
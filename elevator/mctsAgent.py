@@ -0,0 +1,226 @@
+# mctsAgent.py
+# ------------
+# Built from scratch, with the same class structure as naiveAgent.py so it
+# plugs into the game driver in the same way.
+#
+# Monte Carlo tree search (UCT) over joint elevator actions, keeping the
+# part of the tree under the chosen action from one tick to the next.
+
+from game import Agent
+import random, math, time
+
+
+class MCTSNode(object):
+    """
+    Statistics for one sequence of actions from the root. Arrivals are
+    random, so a node stands for every state that sequence can lead to
+    ("open loop" search), and a child is only followed when its action is
+    legal in the state the current simulation has reached.
+    """
+    __slots__ = ('children', 'visits', 'total', 'total_squares')
+
+    def __init__(self):
+        self.children = {}
+        self.visits = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+
+    def getValue(self):
+        return self.total / self.visits
+
+    def getDeviation(self):
+        """
+        Standard deviation of the returns through this node.
+        """
+        mean = self.total / self.visits
+        return math.sqrt(max(self.total_squares / self.visits - mean * mean, 0.0))
+
+    def countNodes(self):
+        count = 0
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(node.children.values())
+        return count
+
+
+class MCTSAgent(Agent):
+    """
+    UCT agent: every simulation samples its own future arrivals, walks
+    down the tree picking children by UCB1, adds a new child, finishes
+    with random actions from rolloutFn until depth steps are played, and
+    backs the score changes up the path. The most visited legal root
+    action is taken.
+
+    - num_simulations: simulations per decision
+    - depth: steps per simulation (tree and random rollout together)
+    - time_limit: if set, seconds per decision; keeps simulating until the
+      time is up instead of using num_simulations
+    - max_nodes: the tree stops growing at this many nodes (simulations
+      then just roll out from the deepest node they reach)
+    - exploration: UCB1 constant, relative to the standard deviation of
+      the returns through the parent node (returns are score changes from
+      the parent's state, whose scale depends on how busy the building is)
+    - widening: joint actions grow exponentially with the number of
+      elevators, so a node with n visits only gets ceil(widening * sqrt(n))
+      children (progressive widening)
+    - rolloutFn: takes a state and the previous action (None at first) and
+      returns the actions to pick randomly from during rollouts, and to
+      draw new children from; defaults to all legal actions
+
+    After a decision, the subtree under the chosen action becomes the new
+    root, so the next tick starts from everything already simulated.
+    """
+
+    def __init__(self, num_simulations=200, depth=10, time_limit=None,
+                 max_nodes=100000, exploration=1.0, widening=2.0,
+                 rolloutFn=None):
+        Agent.__init__(self)
+        if rolloutFn == None:
+            rolloutFn = lambda state, prev_action: state.getLegalActions()
+        self.rolloutFn = rolloutFn
+        self.num_simulations = num_simulations
+        self.depth = depth
+        self.time_limit = time_limit
+        self.max_nodes = max_nodes
+        self.exploration = exploration
+        self.widening = widening
+        self.root = None
+        self.num_nodes = 0
+        self.prev_action = None
+        # stats
+        self.num_decisions = 0
+        self.total_simulations = 0
+        self.total_steps = 0
+
+    def getAction(self, state):
+        if self.root is None:
+            self.root = MCTSNode()
+            self.num_nodes = 1
+        if self.time_limit is None:
+            for _ in range(self.num_simulations):
+                self.simulate(state)
+        else:
+            deadline = time.time() + self.time_limit
+            self.simulate(state)
+            while time.time() < deadline:
+                self.simulate(state)
+        self.num_decisions += 1
+
+        actions = state.getLegalActions()
+        best_action, best_visits = None, 0
+        for action, child in self.root.children.items():
+            if child.visits > best_visits and action in actions:
+                best_action, best_visits = action, child.visits
+        if best_action is None:
+            best_action = actions.sample()
+        return best_action
+
+    def simulate(self, state):
+        """
+        Runs one simulation from state and backs up its return.
+        """
+        sim_state = state.getSimulationState(chunk_size=self.depth + 1)
+        node = self.root
+        path = [node]
+        # score in the state each node on the path acts from
+        scores = [sim_state.score]
+        steps = 0
+        action = self.prev_action
+        # Selection and expansion.
+        while steps < self.depth:
+            actions = sim_state.getLegalActions()
+            limit = int(math.ceil(self.widening * math.sqrt(node.visits + 1)))
+            new_action = None
+            if len(node.children) < limit and self.num_nodes < self.max_nodes:
+                # new children come from the rollout policy's actions
+                new_action = self.getUntriedAction(
+                    node, self.rolloutFn(sim_state, action))
+            if new_action is not None:
+                action = new_action
+                child = MCTSNode()
+                node.children[action] = child
+                self.num_nodes += 1
+                sim_state.applyAction(action)
+                path.append(child)
+                scores.append(sim_state.score)
+                steps += 1
+                break
+            action = self.selectAction(node, actions)
+            if action is None:
+                break
+            node = node.children[action]
+            sim_state.applyAction(action)
+            path.append(node)
+            scores.append(sim_state.score)
+            steps += 1
+        # Random rollout for the rest of the depth.
+        while steps < self.depth:
+            action = random.choice(self.rolloutFn(sim_state, action))
+            sim_state.applyAction(action)
+            steps += 1
+        # Backup. Each node gets the score change from its parent's state,
+        # so siblings are always compared from the same starting point,
+        # even after the tree is reused from a new root.
+        for i in range(len(path)):
+            node = path[i]
+            value = sim_state.score - scores[max(i - 1, 0)]
+            node.visits += 1
+            node.total += value
+            node.total_squares += value * value
+        self.total_simulations += 1
+        self.total_steps += self.depth
+
+    def getUntriedAction(self, node, actions, tries=8):
+        """
+        A random legal action without a child yet, or None if none turns
+        up. Samples instead of listing actions, since there may be many.
+        """
+        if len(node.children) >= len(actions):
+            return None
+        for _ in range(tries):
+            action = actions.sample()
+            if action not in node.children:
+                return action
+        return None
+
+    def selectAction(self, node, actions):
+        """
+        UCB1 over the children whose actions are legal here.
+        """
+        spread = max(node.getDeviation(), 1.0)
+        log_visits = math.log(max(node.visits, 1))
+        best_action, best_value = None, None
+        for action, child in node.children.items():
+            if child.visits == 0 or action not in actions:
+                continue
+            value = (child.getValue() + self.exploration * spread *
+                     math.sqrt(log_visits / child.visits))
+            if best_value is None or value > best_value:
+                best_action, best_value = action, value
+        return best_action
+
+    def doAction(self, observation, action):
+        """
+        Keeps the subtree under the action taken for the next tick.
+        """
+        self.prev_action = action
+        if self.root is None:
+            return
+        self.root = self.root.children.get(action)
+        if self.root is not None:
+            self.num_nodes = self.root.countNodes()
+
+    # methods just to make game driver happy when called,
+    # since it otherwise assumes learning agent methods
+    def registerInitialState(self, state):
+        self.root = None
+        self.num_nodes = 0
+        self.prev_action = None
+
+    def observationFunction(self, state):
+        return state
+
+    def final(self, state):
+        self.root = None
@@ -25,10 +25,8 @@ class NaiveAgent(Agent):
         actions = state.getLegalActions()
         # build list of actions per elevator for ease of use
         num_elevators = state.num_elevators
-        actions_per_el = [set() for _ in range(num_elevators)]
-        for a in actions:
-            for e in range(num_elevators):
-                actions_per_el[e].add(a[e])
+        actions_per_el = [set(actions.getElevatorActions(e))
+                          for e in range(num_elevators)]
         # temp of actions in order per elevator
         chosen_actions = ["" for _ in range(num_elevators)]
         # split into empty and non-empty elevators
@@ -0,0 +1,93 @@
+# phaseProfiler.py
+# ----------------
+# Built from scratch for the game loops in game.py and elevator.py.
+#
+# Counts calls and adds up the time spent in each phase of a step (the
+# agent's decision, the state update, ...), so it's clear where the time
+# of an episode goes without the overhead of a full profiler.
+
+import time
+
+class PhaseProfiler:
+    """
+    Per-phase call counts and seconds. The loops being timed don't time
+    themselves: they ask for timed versions of the functions they call
+    (see timed), and only when they've been given a profiler, so an
+    unprofiled run costs nothing extra. Profilers only hold numbers, so
+    they can come back from worker processes with their episodes.
+
+    Nested phases are ones called from inside other phases, like the
+    learning update inside observationFunction; their time is also part
+    of the phase they're called from. The time of the whole loop is
+    added with addTotal, which is what the phases are shown as a share
+    of.
+    """
+    def __init__(self):
+        self.seconds = {}
+        self.counts = {}
+        # phases in the order they were first timed, and the nested ones
+        self.phases = []
+        self.nested = set()
+        self.total = 0.0
+
+    def addPhase(self, phase, nested=False):
+        if phase not in self.seconds:
+            self.seconds[phase] = 0.0
+            self.counts[phase] = 0
+            self.phases.append(phase)
+        if nested:
+            self.nested.add(phase)
+
+    def timed(self, phase, function, nested=False):
+        """
+        Returns function wrapped so every call to it is counted and timed
+        as phase.
+        """
+        self.addPhase(phase, nested)
+        seconds, counts, clock = self.seconds, self.counts, time.time
+        def timedFunction(*args):
+            start = clock()
+            result = function(*args)
+            seconds[phase] += clock() - start
+            counts[phase] += 1
+            return result
+        return timedFunction
+
+    def addTotal(self, seconds):
+        self.total += seconds
+
+    def merge(self, other):
+        """
+        Adds in the times of another profiler, e.g. another episode's.
+        """
+        for phase in other.phases:
+            self.addPhase(phase, phase in other.nested)
+            self.seconds[phase] += other.seconds[phase]
+            self.counts[phase] += other.counts[phase]
+        self.total += other.total
+
+    def __str__(self):
+        """
+        The phases as a table, top-level ones first, then whatever else
+        the loop did, then the nested phases.
+        """
+        total = self.total
+        rows = []
+        def addRow(name, count, seconds):
+            share = 100.0 * seconds / total if total > 0 else 0.0
+            per_call = '%12.1f' % (1e6 * seconds / count) if count else ' ' * 12
+            rows.append('%-28s %10s %10.3f %7.1f%% %s' % (
+                name, count if count is not None else '', seconds, share,
+                per_call))
+        top = [phase for phase in self.phases if phase not in self.nested]
+        for phase in top:
+            addRow(phase, self.counts[phase], self.seconds[phase])
+        addRow('(other)', None,
+               max(total - sum([self.seconds[phase] for phase in top]), 0.0))
+        addRow('total', None, total)
+        for phase in self.phases:
+            if phase in self.nested:
+                addRow('  ' + phase, self.counts[phase], self.seconds[phase])
+        header = '%-28s %10s %10s %8s %12s' % ('phase', 'calls', 'seconds',
+                                               'time', 'usec/call')
+        return '\n'.join([header] + rows)
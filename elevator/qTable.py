@@ -0,0 +1,192 @@
+# qTable.py
+# ---------
+# Built from scratch as a drop-in replacement for the util.Counter that
+# holds the Q-values of the learning agents in qlearningAgents.py.
+#
+# Keeps Q-values in a dense numpy array, optionally memory-mapped from a
+# file, instead of a dict entry per (state, action).
+
+import numpy, cPickle
+
+# column code of each single elevator action
+ACTION_CODES = {'STALL': 0, 'UP': 1, 'DOWN': 2, 'OPEN_UP': 3, 'OPEN_DOWN': 4}
+ACTION_NAMES = ('STALL', 'UP', 'DOWN', 'OPEN_UP', 'OPEN_DOWN')
+
+class QTable:
+    """
+    Q-values indexed like a util.Counter, by (state key, action) pairs,
+    and 0 for pairs never set. Each state key gets a row, numbered in
+    the order states are first set, and each action a column: a joint
+    action of n elevators is the mixed-radix number of its elevator
+    actions (the first elevator varying fastest), so there are 5^n
+    columns. Single elevator actions (as in FactoredQAgent) are joint
+    actions of one elevator.
+
+    Only the row numbers live in a dict. The values are a float array
+    that grows chunk_rows rows at a time; with a path, it's a file
+    memory-mapped from path + '.values' that grows on disk, so a table
+    can get bigger than memory, and is still there after the process
+    exits. save writes the row index next to it (path + '.index').
+
+    load opens a saved table, read-only by default. Since the values are
+    memory-mapped, processes forked after loading all share the same
+    pages instead of each holding a copy.
+    """
+    def __init__(self, path=None, chunk_rows=1024, dtype='float64'):
+        """
+        Starts an empty table. With a path, any table already saved
+        there is overwritten (see load to open one).
+        """
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.dtype = numpy.dtype(dtype)
+        self.rows = {}
+        # elevators per action; set by the first action stored
+        self.width = None
+        self.values = None
+        self.readonly = False
+        if path is not None:
+            open(self.getValuesPath(), 'wb').close()
+
+    def getValuesPath(self, path=None):
+        return (path or self.path) + '.values'
+
+    def getIndexPath(self, path=None):
+        return (path or self.path) + '.index'
+
+    def encodeAction(self, action):
+        """
+        The column of action.
+        """
+        if isinstance(action, str):
+            action = (action,)
+        if self.width is None:
+            self.width = len(action)
+        elif len(action) != self.width:
+            raise Exception('Q-table holds actions of %d elevators, not %d'
+                            % (self.width, len(action)))
+        index = 0
+        for elevator_action in reversed(action):
+            index = index * 5 + ACTION_CODES[elevator_action]
+        return index
+
+    def __getitem__(self, key):
+        state, action = key
+        row = self.rows.get(state)
+        if row is None:
+            return 0.0
+        return float(self.values[row, self.encodeAction(action)])
+
+    def __setitem__(self, key, value):
+        state, action = key
+        column = self.encodeAction(action)
+        row = self.rows.get(state)
+        if row is None:
+            row = self.addRow(state)
+        self.values[row, column] = value
+
+    def __len__(self):
+        """
+        The number of states with a row.
+        """
+        return len(self.rows)
+
+    def addRow(self, state):
+        if self.readonly:
+            raise Exception('Q-table is read-only')
+        row = len(self.rows)
+        if self.values is None or row >= self.values.shape[0]:
+            self.grow(row + self.chunk_rows)
+        self.rows[state] = row
+        return row
+
+    def grow(self, num_rows):
+        """
+        Makes room for num_rows rows, the new ones all zero.
+        """
+        shape = (num_rows, 5 ** self.width)
+        if self.path is None:
+            values = numpy.zeros(shape, self.dtype)
+            if self.values is not None:
+                values[:len(self.values)] = self.values
+        else:
+            if self.values is not None:
+                self.values.flush()
+            # extending the file fills it with zeros without copying
+            # anything, then the whole file is mapped again
+            f = open(self.getValuesPath(), 'r+b')
+            f.truncate(shape[0] * shape[1] * self.dtype.itemsize)
+            f.close()
+            values = numpy.memmap(self.getValuesPath(), dtype=self.dtype,
+                                  mode='r+', shape=shape)
+        self.values = values
+
+    def save(self, path=None):
+        """
+        Saves the table to path, by default the one it's mapped from (in
+        which case only the index is written, and the values flushed).
+        """
+        if path is None:
+            path = self.path
+        if path is None:
+            raise Exception('No path to save the Q-table to')
+        if path == self.path:
+            if self.values is not None:
+                self.values.flush()
+        elif self.values is not None:
+            self.values.tofile(self.getValuesPath(path))
+        else:
+            open(self.getValuesPath(path), 'wb').close()
+        num_rows = 0 if self.values is None else self.values.shape[0]
+        index = {'rows': self.rows, 'width': self.width,
+                 'dtype': self.dtype.str, 'num_rows': num_rows}
+        f = open(self.getIndexPath(path), 'wb')
+        cPickle.dump(index, f, cPickle.HIGHEST_PROTOCOL)
+        f.close()
+
+    def __getstate__(self):
+        """
+        Pickles only the rows in use, copied out of memory or the file.
+        """
+        state = self.__dict__.copy()
+        if self.values is not None:
+            state['values'] = numpy.array(self.values[:len(self.rows)])
+        return state
+
+    def __setstate__(self, state):
+        """
+        Unpickled tables (like the ones in checkpoints) are kept in
+        memory, writable, whatever file they were mapped from: loading
+        never writes to a file that others may have mapped. To map one
+        again, save it to a path and load it from there.
+        """
+        values = state.pop('values')
+        self.__dict__.update(state)
+        self.path = None
+        self.values = None
+        self.readonly = False
+        if values is not None:
+            self.grow(len(values) + self.chunk_rows)
+            self.values[:len(values)] = values
+
+    def load(path, readonly=True):
+        """
+        Opens the table saved at path, memory-mapped. Unless readonly,
+        it can keep learning, growing the same file.
+        """
+        f = open(path + '.index', 'rb')
+        index = cPickle.load(f)
+        f.close()
+        table = QTable(dtype=index['dtype'])
+        table.path = path
+        table.rows = index['rows']
+        table.width = index['width']
+        table.readonly = readonly
+        if index['num_rows'] > 0:
+            table.values = numpy.memmap(table.getValuesPath(),
+                                        dtype=table.dtype,
+                                        mode='r' if readonly else 'r+',
+                                        shape=(index['num_rows'],
+                                               5 ** table.width))
+        return table
+    load = staticmethod(load)
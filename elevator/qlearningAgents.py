@@ -12,10 +12,34 @@
 
 from game import *
 from learningAgents import ReinforcementAgent
+from featureExtractors import ElevatorFeatureExtractor
+from qTable import QTable, ACTION_CODES, ACTION_NAMES
+from replayBuffer import ReplayBuffer
 
 import random
 import util
 import math
+import numpy
+import cPickle, os
+
+# Encodings of actions for the replay buffer: an action as the code of
+# each elevator's action, legal actions as a mask of codes per elevator.
+def encodeAction(action):
+    return [ACTION_CODES[a] for a in action]
+
+def decodeAction(codes):
+    return tuple([ACTION_NAMES[code] for code in codes])
+
+def encodeLegalActions(actions, num_elevators):
+    mask = numpy.zeros((num_elevators, len(ACTION_NAMES)), bool)
+    for i in range(num_elevators):
+        for a in actions.getElevatorActions(i):
+            mask[i, ACTION_CODES[a]] = True
+    return mask
+
+def decodeLegalActions(mask):
+    return JointActions([[ACTION_NAMES[code] for code in numpy.flatnonzero(row)]
+                         for row in mask])
 
 class QLearningAgent(ReinforcementAgent):
     """
@@ -36,13 +60,43 @@ class QLearningAgent(ReinforcementAgent):
       Functions you should use
         - self.getLegalActions(state)
           which returns legal actions for a state
+
+      Q-values are keyed on state.getStateKey(abstraction), so states that
+      look the same under the abstraction share their values (see
+      GameState.STATE_ABSTRACTIONS).
+
+      The Q-values are kept in table if given (e.g. a qTable.QTable),
+      or else in a util.Counter.
+
+      With replay set, the last replay transitions are kept in a
+      ReplayBuffer, and every step learns from a mini-batch of
+      replayBatch of them (sampled by TD error if prioritized) instead
+      of just the newest one (see replayUpdate).
     """
-    def __init__(self, **args):
+    # most states getBest keeps the answer for at once
+    BEST_CACHE_SIZE = 100000
+
+    def __init__(self, abstraction='calls', table=None, replay=0,
+                 replayBatch=32, prioritized=False, **args):
         "You can initialize Q-values here..."
         ReinforcementAgent.__init__(self, **args)
 
         "*** YOUR CODE HERE ***"
-        self.values = util.Counter()
+        self.abstraction = abstraction
+        # epsilon and alpha while training, which stopEpisode turns off
+        # once it's over; checkpoints keep these (see saveCheckpoint)
+        self.training_epsilon = self.epsilon
+        self.training_alpha = self.alpha
+        if table is None:
+            table = util.Counter()
+        self.values = table
+        # experience replay; the buffer is made on the first update
+        self.replay_capacity = int(replay)
+        self.replay_batch = int(replayBatch)
+        self.prioritized = prioritized
+        self.replay = None
+        # state key => (legal actions, best Q-value, best actions)
+        self.best_cache = {}
 
     def getQValue(self, state, action):
         """
@@ -54,7 +108,7 @@ class QLearningAgent(ReinforcementAgent):
         # note that it's a counter, so returns 0 by default
         # (i.e. not seen before)
         # just cast it in case
-        return self.values[(state, action)] * 1.0
+        return self.values[(state.getStateKey(self.abstraction), action)] * 1.0
 
     def computeValueFromQValues(self, state):
         """
@@ -64,17 +118,74 @@ class QLearningAgent(ReinforcementAgent):
           terminal state, you should return a value of 0.0.
         """
         "*** YOUR CODE HERE ***"
-        actions = self.getLegalActions(state)
+        actions, best_value, _ = self.getBest(state)
         if len(actions) is 0:
             return 0.0
-        # just return the best value
-        best_value = -pow(10, 6)
-        for a in actions:
-            value = self.getQValue(state, a)
-            if value > best_value:
-                best_value = value
         return best_value
 
+    def computeValueFromKey(self, key, actions):
+        """
+          max_action Q(state,action) for the state with key.
+        """
+        if len(actions) is 0:
+            return 0.0
+        return self.getBestForKey(key, actions)[1]
+
+    def getBest(self, state):
+        """
+          The legal actions of state, its best Q-value and the actions
+          with that value, from the cache (see getBestForKey).
+        """
+        key = state.getStateKey(self.abstraction)
+        entry = self.best_cache.get(key)
+        if entry is None:
+            entry = self.getBestForKey(key, self.getLegalActions(state))
+        return entry
+
+    def getBestForKey(self, key, actions):
+        """
+          Like getBest, for the state with key and legal actions. States
+          with the same key have the same legal actions, so one scan of
+          the actions serves every later call until the state's values
+          change, and setQValue keeps the entry up to date when they do.
+        """
+        entry = self.best_cache.get(key)
+        if entry is not None:
+            return entry
+        best_value, best_actions = None, []
+        for a in actions:
+            value = self.values[(key, a)] * 1.0
+            if best_value is None or value > best_value:
+                best_value, best_actions = value, [a]
+            elif value == best_value:
+                best_actions.append(a)
+        if len(self.best_cache) >= self.BEST_CACHE_SIZE:
+            self.best_cache.clear()
+        entry = (actions, best_value, best_actions)
+        self.best_cache[key] = entry
+        return entry
+
+    def setQValue(self, key, action, value):
+        """
+          Sets Q(state,action) for the state with key, updating the
+          cached best value and actions of that state.
+        """
+        self.values[(key, action)] = value
+        entry = self.best_cache.get(key)
+        if entry is None:
+            return
+        actions, best_value, best_actions = entry
+        if value > best_value:
+            self.best_cache[key] = (actions, value, [action])
+        elif value == best_value:
+            if action not in best_actions:
+                best_actions.append(action)
+        elif action in best_actions:
+            best_actions.remove(action)
+            if not best_actions:
+                # the new best needs another scan, when it's next asked for
+                del self.best_cache[key]
+
     def computeActionFromQValues(self, state):
         """
           Compute the best action to take in a state.  Note that if there
@@ -82,18 +193,11 @@ class QLearningAgent(ReinforcementAgent):
           you should return None.
         """
         "*** YOUR CODE HERE ***"
-        actions = self.getLegalActions(state)
-        best_action = None
-        best_value = -pow(10, 6)
-        # just return the best action
-        for a in actions:
-            value = self.getQValue(state, a)
-            # also randomly pick if both equally good
-            if (value > best_value or
-                    (value == best_value and random.random() < 0.5)):
-                best_value = value
-                best_action = a
-        return best_action
+        actions, _, best_actions = self.getBest(state)
+        if len(actions) is 0:
+            return None
+        # randomly pick between equally good actions
+        return random.choice(best_actions)
 
     def getAction(self, state):
         """
@@ -123,11 +227,79 @@ class QLearningAgent(ReinforcementAgent):
           it will be called on your behalf
         """
         "*** YOUR CODE HERE ***"
+        if self.alpha == 0:
+            # not learning (any more), so nothing would change; this way
+            # a read-only table still works
+            return
+        if self.replay_capacity > 0:
+            self.replayUpdate(state, action, nextState, reward)
+            return
         old = (1 - self.alpha) * self.getQValue(state, action)
         new = self.alpha * (reward +
                             self.discount *
                             self.computeValueFromQValues(nextState))
-        self.values[(state, action)] = old + new
+        self.setQValue(state.getStateKey(self.abstraction), action, old + new)
+
+    def replayUpdate(self, state, action, nextState, reward):
+        """
+          Stores the transition in the replay buffer, then learns from a
+          mini-batch of stored transitions once there are enough, so each
+          simulated step is learned from many times.
+        """
+        if self.replay is None:
+            self.replay = ReplayBuffer(self.replay_capacity,
+                                       self.getReplayFields(state),
+                                       prioritized=self.prioritized)
+        self.replay.add(**self.encodeTransition(state, action, nextState,
+                                                reward))
+        if len(self.replay) >= self.replay_batch:
+            indices, batch, weights = self.replay.sample(self.replay_batch)
+            self.replay.setPriorities(indices,
+                                      self.updateFromBatch(batch, weights))
+
+    def getReplayFields(self, state):
+        """
+          The fields of a transition in the replay buffer (see
+          ReplayBuffer): states are stored as their keys, in object
+          arrays, so a key is let go of once the last transition holding
+          it is overwritten.
+        """
+        E = state.num_elevators
+        return {'state': ((), 'object'), 'action': ((E,), 'int8'),
+                'reward': ((), 'float64'), 'next_state': ((), 'object'),
+                'next_actions': ((E, len(ACTION_NAMES)), 'bool'),
+                'done': ((), 'bool')}
+
+    def encodeTransition(self, state, action, nextState, reward):
+        next_actions = self.getLegalActions(nextState)
+        return {'state': state.getStateKey(self.abstraction),
+                'action': encodeAction(action),
+                'reward': reward,
+                'next_state': nextState.getStateKey(self.abstraction),
+                'next_actions': encodeLegalActions(next_actions,
+                                                   nextState.num_elevators),
+                'done': len(next_actions) == 0}
+
+    def updateFromBatch(self, batch, weights):
+        """
+          The Q-learning update for each transition of a replayed batch,
+          scaled by its importance weight. Returns the TD errors.
+        """
+        errors = numpy.zeros(len(weights))
+        for j in range(len(weights)):
+            key = batch['state'][j]
+            action = decodeAction(batch['action'][j])
+            next_value = 0.0
+            if not batch['done'][j]:
+                next_value = self.computeValueFromKey(
+                    batch['next_state'][j],
+                    decodeLegalActions(batch['next_actions'][j]))
+            error = (batch['reward'][j] + self.discount * next_value -
+                     self.values[(key, action)])
+            self.setQValue(key, action, self.values[(key, action)] +
+                           self.alpha * weights[j] * error)
+            errors[j] = error
+        return errors
 
     def getPolicy(self, state):
         return self.computeActionFromQValues(state)
@@ -135,6 +307,81 @@ class QLearningAgent(ReinforcementAgent):
     def getValue(self, state):
         return self.computeValueFromQValues(state)
 
+    def getLearnedValues(self):
+        """
+          What the agent has learned, to be pickled into checkpoints.
+        """
+        return self.values
+
+    def setLearnedValues(self, values):
+        self.values = values
+        self.best_cache = {}
+
+    def saveCheckpoint(self, path):
+        """
+          Saves everything needed to pick training up where it is now:
+          the learned values, the episode counts and rewards, epsilon and
+          alpha (both as they are and as they are while training, since
+          they're turned off after training), and the state of both
+          random number generators. The file is replaced in one step, so
+          an interrupted save leaves the previous checkpoint.
+        """
+        checkpoint = {'values': self.getLearnedValues(),
+                      'episodesSoFar': self.episodesSoFar,
+                      'accumTrainRewards': self.accumTrainRewards,
+                      'accumTestRewards': self.accumTestRewards,
+                      'epsilon': self.epsilon,
+                      'alpha': self.alpha,
+                      'trainingEpsilon': self.training_epsilon,
+                      'trainingAlpha': self.training_alpha,
+                      'discount': self.discount,
+                      'random': random.getstate(),
+                      'numpy.random': numpy.random.get_state()}
+        f = open(path + '.tmp', 'wb')
+        cPickle.dump(checkpoint, f, cPickle.HIGHEST_PROTOCOL)
+        f.close()
+        os.rename(path + '.tmp', path)
+
+    def loadCheckpoint(self, path, restoreRandom=True):
+        """
+          Loads a checkpoint from saveCheckpoint. With restoreRandom,
+          the random number generators continue from where they were,
+          so a resumed run plays out like one that was never stopped.
+          Epsilon and alpha are the checkpoint's training ones as long as
+          this agent has training episodes left, even if the checkpoint
+          was saved after its own training was over.
+        """
+        f = open(path, 'rb')
+        checkpoint = cPickle.load(f)
+        f.close()
+        self.setLearnedValues(checkpoint['values'])
+        self.episodesSoFar = checkpoint['episodesSoFar']
+        self.accumTrainRewards = checkpoint['accumTrainRewards']
+        self.accumTestRewards = checkpoint['accumTestRewards']
+        # checkpoints from before training values were kept only have
+        # the current ones
+        self.training_epsilon = checkpoint.get('trainingEpsilon',
+                                               checkpoint['epsilon'])
+        self.training_alpha = checkpoint.get('trainingAlpha',
+                                             checkpoint['alpha'])
+        if self.isInTraining():
+            self.epsilon = self.training_epsilon
+            self.alpha = self.training_alpha
+        else:
+            self.epsilon = self.alpha = 0.0
+        self.discount = checkpoint['discount']
+        if restoreRandom:
+            random.setstate(checkpoint['random'])
+            numpy.random.set_state(checkpoint['numpy.random'])
+
+    def stopTraining(self):
+        """
+          Skips whatever training is left: no more exploring or learning.
+        """
+        self.numTraining = self.episodesSoFar
+        self.epsilon = 0.0
+        self.alpha = 0.0
+
 
 class PacmanQAgent(QLearningAgent):
     "Exactly the same as QLearningAgent, but with different default parameters"
@@ -166,3 +413,276 @@ class PacmanQAgent(QLearningAgent):
         action = QLearningAgent.getAction(self, state)
         self.doAction(state, action)
         return action
+
+
+class FactoredQAgent(QLearningAgent):
+    """
+       Factored Q-Learning Agent
+
+       Q(state, action) is a sum of one component per elevator,
+       Q_i(key_i, action_i), keyed on what that elevator sees (see
+       GameState.getElevatorStateKeys) and its own action. With shared
+       set, all elevators use the same components (an elevator is an
+       elevator); otherwise each elevator learns its own.
+
+       The best joint action is then each elevator's best action, so
+       choosing actions and updating costs O(elevators * 5) instead of
+       going through all O(5^elevators) joint actions.
+    """
+    def __init__(self, shared=True, **args):
+        QLearningAgent.__init__(self, **args)
+        self.shared = shared
+
+    def getComponentKey(self, keys, elevator_id, elevator_action):
+        if self.shared:
+            return (keys[elevator_id], elevator_action)
+        return ((elevator_id, keys[elevator_id]), elevator_action)
+
+    def getQValue(self, state, action):
+        keys = state.getElevatorStateKeys()
+        return sum([self.values[self.getComponentKey(keys, i, action[i])]
+                    for i in range(state.num_elevators)]) * 1.0
+
+    def getBestComponents(self, state, actions):
+        """
+          A list (per elevator) of the best component value and the
+          actions that get it.
+        """
+        keys = state.getElevatorStateKeys()
+        best = []
+        for i in range(state.num_elevators):
+            best_value, best_actions = None, []
+            for a in actions.getElevatorActions(i):
+                value = self.values[self.getComponentKey(keys, i, a)]
+                if best_value is None or value > best_value:
+                    best_value, best_actions = value, [a]
+                elif value == best_value:
+                    best_actions.append(a)
+            best.append((best_value, best_actions))
+        return best
+
+    def computeValueFromQValues(self, state):
+        actions = self.getLegalActions(state)
+        if len(actions) is 0:
+            return 0.0
+        return sum([value for value, _ in
+                    self.getBestComponents(state, actions)]) * 1.0
+
+    def computeActionFromQValues(self, state):
+        actions = self.getLegalActions(state)
+        if len(actions) is 0:
+            return None
+        # pick randomly between equally good actions
+        return tuple([random.choice(best_actions) for _, best_actions in
+                      self.getBestComponents(state, actions)])
+
+    def update(self, state, action, nextState, reward):
+        """
+          Every component moves by an equal share of the TD error, so
+          their sum moves by alpha times the error, as in the tabular case.
+        """
+        if self.alpha == 0:
+            return
+        if self.replay_capacity > 0:
+            self.replayUpdate(state, action, nextState, reward)
+            return
+        difference = (reward +
+                      self.discount * self.computeValueFromQValues(nextState) -
+                      self.getQValue(state, action))
+        keys = state.getElevatorStateKeys()
+        step = self.alpha * difference / state.num_elevators
+        for i in range(state.num_elevators):
+            self.values[self.getComponentKey(keys, i, action[i])] += step
+
+    def getReplayFields(self, state):
+        # states are each elevator's component key
+        fields = QLearningAgent.getReplayFields(self, state)
+        fields['state'] = fields['next_state'] = ((state.num_elevators,),
+                                                  'object')
+        return fields
+
+    def getComponentKeys(self, state):
+        keys = state.getElevatorStateKeys()
+        return [self.getComponentKey(keys, i, None)[0]
+                for i in range(state.num_elevators)]
+
+    def encodeTransition(self, state, action, nextState, reward):
+        next_actions = self.getLegalActions(nextState)
+        return {'state': self.getComponentKeys(state),
+                'action': encodeAction(action),
+                'reward': reward,
+                'next_state': self.getComponentKeys(nextState),
+                'next_actions': encodeLegalActions(next_actions,
+                                                   nextState.num_elevators),
+                'done': len(next_actions) == 0}
+
+    def updateFromBatch(self, batch, weights):
+        errors = numpy.zeros(len(weights))
+        for j in range(len(weights)):
+            components = [(key, ACTION_NAMES[code])
+                          for key, code in zip(batch['state'][j],
+                                               batch['action'][j])]
+            next_value = 0.0
+            if not batch['done'][j]:
+                for key, row in zip(batch['next_state'][j],
+                                    batch['next_actions'][j]):
+                    next_value += max([self.values[(key, ACTION_NAMES[code])]
+                                       for code in numpy.flatnonzero(row)])
+            error = (batch['reward'][j] + self.discount * next_value -
+                     sum([self.values[component] for component in components]))
+            step = self.alpha * weights[j] * error / len(components)
+            for component in components:
+                self.values[component] += step
+            errors[j] = error
+        return errors
+
+
+class ApproximateQAgent(QLearningAgent):
+    """
+       ApproximateQLearningAgent
+
+       Q(state, action) is a weighted sum of the features from
+       ElevatorFeatureExtractor, so what's learned about one state carries
+       over to similar ones, and the only thing stored is one weight
+       vector, however long training runs.
+
+       The features of a joint action are a sum over elevators, so the
+       values of all of an elevator's candidate actions come from a single
+       matrix product, and the best joint action is each elevator's best
+       action: the joint actions are never listed.
+    """
+    def __init__(self, alpha=0.01, gamma=0.9, **args):
+        args['alpha'] = alpha
+        args['gamma'] = gamma
+        QLearningAgent.__init__(self, **args)
+        # built on the first state seen, which gives the feature sizes
+        self.featExtractor = None
+        self.weights = None
+
+    def getWeights(self):
+        return self.weights
+
+    def getLearnedValues(self):
+        return (self.featExtractor, self.weights)
+
+    def setLearnedValues(self, values):
+        self.featExtractor, self.weights = values
+
+    def getExtractor(self, state):
+        if self.featExtractor is None:
+            self.featExtractor = ElevatorFeatureExtractor(
+                state.num_elevators, state.num_floors, state.elevator_capacity)
+            self.weights = numpy.zeros(self.featExtractor.num_features)
+        return self.featExtractor
+
+    def getElevatorQValues(self, state, actions):
+        """
+          The weighted state features, and a list (per elevator) of the
+          weighted action features of each of its legal actions, which
+          add up to the Q-values.
+        """
+        extractor = self.getExtractor(state)
+        split = extractor.num_state_features
+        state_value = numpy.dot(extractor.getStateFeatures(state),
+                                self.weights[:split])
+        action_values = [numpy.dot(extractor.getActionFeatures(
+                                       state, i, actions.getElevatorActions(i)),
+                                   self.weights[split:])
+                         for i in range(state.num_elevators)]
+        return state_value, action_values
+
+    def getQValue(self, state, action):
+        """
+          Should return Q(state,action) = w * featureVector
+        """
+        return numpy.dot(self.getExtractor(state).getFeatures(state, action),
+                         self.weights)
+
+    def computeValueFromQValues(self, state):
+        actions = self.getLegalActions(state)
+        if len(actions) is 0:
+            return 0.0
+        state_value, action_values = self.getElevatorQValues(state, actions)
+        return state_value + sum([values.max() for values in action_values])
+
+    def computeActionFromQValues(self, state):
+        actions = self.getLegalActions(state)
+        if len(actions) is 0:
+            return None
+        _, action_values = self.getElevatorQValues(state, actions)
+        action = []
+        for i, values in enumerate(action_values):
+            # pick randomly between equally good actions
+            best = numpy.flatnonzero(values == values.max())
+            action.append(actions.getElevatorActions(i)[random.choice(best)])
+        return tuple(action)
+
+    def update(self, state, action, nextState, reward):
+        """
+           Should update your weights based on transition
+        """
+        if self.alpha == 0:
+            return
+        if self.replay_capacity > 0:
+            self.replayUpdate(state, action, nextState, reward)
+            return
+        features = self.getExtractor(state).getFeatures(state, action)
+        difference = (reward + self.discount *
+                      self.computeValueFromQValues(nextState) -
+                      numpy.dot(features, self.weights))
+        self.weights += self.alpha * difference * features
+
+    def getReplayFields(self, state):
+        # transitions are stored as features: those of the action taken,
+        # and those the next state's values are computed from
+        extractor = self.getExtractor(state)
+        E = state.num_elevators
+        num_codes = len(ACTION_NAMES)
+        return {'features': ((extractor.num_features,), 'float64'),
+                'reward': ((), 'float64'),
+                'next_state_features': ((extractor.num_state_features,),
+                                        'float64'),
+                'next_action_features': ((E, num_codes,
+                                          extractor.NUM_ACTION_FEATURES),
+                                         'float64'),
+                'next_actions': ((E, num_codes), 'bool'),
+                'done': ((), 'bool')}
+
+    def encodeTransition(self, state, action, nextState, reward):
+        extractor = self.getExtractor(state)
+        next_actions = self.getLegalActions(nextState)
+        action_features = numpy.zeros((nextState.num_elevators,
+                                       len(ACTION_NAMES),
+                                       extractor.NUM_ACTION_FEATURES))
+        for i in range(nextState.num_elevators):
+            elevator_actions = next_actions.getElevatorActions(i)
+            codes = [ACTION_CODES[a] for a in elevator_actions]
+            action_features[i, codes] = extractor.getActionFeatures(
+                nextState, i, elevator_actions)
+        return {'features': extractor.getFeatures(state, action),
+                'reward': reward,
+                'next_state_features': extractor.getStateFeatures(nextState),
+                'next_action_features': action_features,
+                'next_actions': encodeLegalActions(next_actions,
+                                                   nextState.num_elevators),
+                'done': len(next_actions) == 0}
+
+    def updateFromBatch(self, batch, weights):
+        """
+           One gradient step on the whole batch at once: the mean of the
+           per-transition updates, scaled by their importance weights.
+        """
+        split = self.featExtractor.num_state_features
+        action_values = numpy.dot(batch['next_action_features'],
+                                  self.weights[split:])
+        action_values[~batch['next_actions']] = -numpy.inf
+        next_values = (numpy.dot(batch['next_state_features'],
+                                 self.weights[:split]) +
+                       action_values.max(2).sum(1))
+        next_values[batch['done']] = 0.0
+        errors = (batch['reward'] + self.discount * next_values -
+                  numpy.dot(batch['features'], self.weights))
+        self.weights += (self.alpha * numpy.dot(weights * errors,
+                                                batch['features']) /
+                         len(errors))
+        return errors
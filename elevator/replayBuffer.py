@@ -0,0 +1,86 @@
+# replayBuffer.py
+# ---------------
+# Built from scratch for the learning agents in qlearningAgents.py.
+#
+# A fixed-size store of past transitions, so agents can learn from each
+# simulated step many times instead of once.
+
+import numpy
+
+class ReplayBuffer:
+    """
+    A ring buffer of the last capacity transitions, kept in numpy arrays
+    preallocated when the buffer is made: one array per field, whose
+    rows are transitions. fields maps each field name to the (shape,
+    dtype) of one transition's value, so the buffer doesn't care how an
+    agent encodes its states and actions.
+
+    With prioritized set, transitions are sampled in proportion to
+    priority ** alpha, where the priority is the size of a transition's
+    last TD error (see setPriorities); new transitions get the highest
+    priority so far, so everything is sampled at least once in a while.
+    sample then also returns importance weights, (N * P(i)) ** -beta
+    scaled to at most 1, which undo the bias of sampling unevenly.
+    Uniform sampling has weights of 1.
+    """
+    def __init__(self, capacity, fields, prioritized=False, alpha=0.6,
+                 beta=0.4, epsilon=0.01):
+        self.capacity = capacity
+        self.arrays = {}
+        for name, (shape, dtype) in fields.items():
+            self.arrays[name] = numpy.zeros((capacity,) + tuple(shape), dtype)
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+        self.priorities = numpy.zeros(capacity)
+        self.max_priority = 1.0
+        # where the next transition goes, and how many there are
+        self.next = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, **values):
+        """
+        Stores a transition, given as one value per field, over the
+        oldest one once the buffer is full.
+        """
+        i = self.next
+        for name, value in values.items():
+            self.arrays[name][i] = value
+        self.priorities[i] = self.max_priority
+        self.next = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, batch_size):
+        """
+        Returns the indices of batch_size transitions sampled with
+        replacement, a dict of their field arrays, and their importance
+        weights.
+        """
+        if not self.prioritized:
+            indices = numpy.random.randint(0, self.size, size=batch_size)
+            return (indices, self.getBatch(indices),
+                    numpy.ones(batch_size))
+        scaled = self.priorities[:self.size] ** self.alpha
+        probabilities = scaled / scaled.sum()
+        indices = numpy.random.choice(self.size, size=batch_size,
+                                      p=probabilities)
+        weights = (self.size * probabilities[indices]) ** -self.beta
+        return indices, self.getBatch(indices), weights / weights.max()
+
+    def getBatch(self, indices):
+        return dict([(name, array[indices])
+                     for name, array in self.arrays.items()])
+
+    def setPriorities(self, indices, errors):
+        """
+        Records the TD errors just seen for the transitions at indices.
+        """
+        if not self.prioritized:
+            return
+        priorities = numpy.abs(errors) + self.epsilon
+        self.priorities[indices] = priorities
+        self.max_priority = max(self.max_priority, priorities.max())
@@ -0,0 +1,87 @@
+# resultsWriter.py
+# ----------------
+# Built from scratch for the drivers in elevator.py.
+#
+# Streams one record per episode to a JSON lines or CSV file, so results
+# can be loaded straight into analysis tools instead of copied out of
+# printed output.
+
+import json, csv, fcntl, os, StringIO
+
+class ResultsWriter:
+    """
+    Buffers records (flat dicts) and appends them to path every
+    flush_every records, and on flush or close. Files ending in .csv get
+    CSV, with a header of fields when the file is new; by default the
+    fields are those of the file's header if it has one, or else the
+    keys of the first record, sorted. Records with fields that aren't
+    among them are refused rather than cut down to fit. Anything else
+    gets one JSON object per line.
+
+    Each flush appends its whole batch with a single write while holding
+    an exclusive lock on the file, so several processes can append to
+    the same file without their records getting mixed up.
+    """
+    def __init__(self, path, fields=None, flush_every=10):
+        self.path = path
+        self.csv = path.endswith('.csv')
+        self.fields = fields
+        self.flush_every = flush_every
+        self.buffer = []
+
+    def write(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def format(self, records, header):
+        if not self.csv:
+            return ''.join([json.dumps(record, sort_keys=True) + '\n'
+                            for record in records])
+        out = StringIO.StringIO()
+        writer = csv.DictWriter(out, self.fields)
+        if header:
+            writer.writerow(dict(zip(self.fields, self.fields)))
+        writer.writerows(records)
+        return out.getvalue()
+
+    def checkFields(self, records):
+        """
+        Raises an exception, before anything is written, if any of records
+        has fields the CSV file has no columns for.
+        """
+        extra = set()
+        for record in records:
+            extra.update(record.keys())
+        extra.difference_update(self.fields)
+        if extra:
+            raise Exception('Records have fields %s that %s has no columns '
+                            'for: write them to another file' %
+                            (', '.join(sorted(extra)), self.path))
+
+    def flush(self):
+        if not self.buffer:
+            return
+        f = open(self.path, 'a+')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # only the first batch written to a file gets the header
+            header = os.fstat(f.fileno()).st_size == 0
+            if self.csv and self.fields is None:
+                if header:
+                    self.fields = sorted(self.buffer[0].keys())
+                else:
+                    f.seek(0)
+                    self.fields = csv.reader([f.readline()]).next()
+                    f.seek(0, os.SEEK_END)
+            if self.csv:
+                self.checkFields(self.buffer)
+            f.write(self.format(self.buffer, header))
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+        self.buffer = []
+
+    def close(self):
+        self.flush()
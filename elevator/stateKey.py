@@ -0,0 +1,40 @@
+# stateKey.py
+# -----------
+# Built from scratch for the Q-value tables of the learning agents.
+#
+# Lives in its own module, not elevator.py (which runs as __main__), so
+# pickled keys in checkpoints and saved Q-tables load from any script.
+
+class StateKey(object):
+    """
+    An immutable, hashable summary of a GameState, used to key tables
+    like the Q-values. The hash is computed once, when the key is built,
+    and two keys are equal exactly when their summaries are.
+    """
+    __slots__ = ('data', 'hash')
+
+    def __init__(self, data):
+        self.data = data
+        self.hash = hash(data)
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        return (isinstance(other, StateKey) and self.hash == other.hash and
+                self.data == other.data)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'StateKey(%r)' % (self.data,)
+
+    # Only the summary is pickled, and the hash is computed again when
+    # it's loaded: hashes of some values (like None) differ between runs.
+    def __getstate__(self):
+        return self.data
+
+    def __setstate__(self, data):
+        self.data = data
+        self.hash = hash(data)
@@ -628,6 +628,9 @@ class WritableNull:
     def write(self, string):
         pass
 
+    def flush(self):
+        pass
+
 def mutePrint():
     global _ORIGINAL_STDOUT, _ORIGINAL_STDERR, _MUTED
     if _MUTED: